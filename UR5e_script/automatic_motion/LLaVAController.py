@@ -1,319 +1,417 @@
 import requests
-import datetime
+from requests.adapters import HTTPAdapter
+import asyncio
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
-import hashlib
 import time
-import gradio as gr
 from LLaVA.llava.constants import LOGDIR
-from LLaVA.llava.conversation import default_conversation, conv_templates, SeparatorStyle
-from LLaVA.llava.utils import build_logger, server_error_msg
-
+from LLaVA.llava.conversation import conv_templates, SeparatorStyle
+from LLaVA.llava.utils import build_logger
+from llava_util.stream import CommandStreamMatcher
+from llava_util.payload import PayloadCache
+from llava_util.archiver import ImageArchiver
+from llava_util.log_sink import JsonlLogSink
+
+
+# A single-turn prompt rendered once per controller: full text, the part before the first image,
+# the stop string and the conversation as it is written to the log
+CompiledPrompt = namedtuple("CompiledPrompt", ["prompt", "prefix", "stop", "state"])
+
+
+def resolve_template_name(model_name):
+    """Pick the conversation template for a model, the same way the LLaVA web server does."""
+    if "llava" in model_name.lower():
+        if 'llama-2' in model_name.lower():
+            template_name = "llava_llama_2"
+        elif "mistral" in model_name.lower() or "mixtral" in model_name.lower():
+            if 'orca' in model_name.lower():
+                template_name = "mistral_orca"
+            elif 'hermes' in model_name.lower():
+                template_name = "chatml_direct"
+            else:
+                template_name = "mistral_instruct"
+        elif 'llava-v1.6-34b' in model_name.lower():
+            template_name = "chatml_direct"
+        elif "v1" in model_name.lower():
+            if 'mmtag' in model_name.lower():
+                template_name = "v1_mmtag"
+            elif 'plain' in model_name.lower() and 'finetune' not in model_name.lower():
+                template_name = "v1_mmtag"
+            else:
+                template_name = "llava_v1"
+        elif "mpt" in model_name.lower():
+            template_name = "mpt"
+        else:
+            if 'mmtag' in model_name.lower():
+                template_name = "v0_mmtag"
+            elif 'plain' in model_name.lower() and 'finetune' not in model_name.lower():
+                template_name = "v0_mmtag"
+            else:
+                template_name = "llava_v0"
+    elif "mpt" in model_name:
+        template_name = "mpt_text"
+    elif "llama-2" in model_name:
+        template_name = "llama_2"
+    else:
+        template_name = "vicuna_v1"
+    return template_name
+
+
+def compile_prompt(template_name, message):
+    """Render a single user turn with an empty assistant reply; only get_prompt() reads the message."""
+    state = conv_templates[template_name].copy()
+    state.append_message(state.roles[0], message)
+    state.append_message(state.roles[1], None)
+    prompt = state.get_prompt()
+    stop = state.sep if state.sep_style in [SeparatorStyle.SINGLE, SeparatorStyle.MPT] else state.sep2
+    prefix = prompt[:prompt.index("<image>")] if "<image>" in prompt else prompt
+    log_state = {
+        "system": state.system,
+        "roles": state.roles,
+        "messages": [[role, msg[0] if isinstance(msg, tuple) else msg] for role, msg in state.messages],
+        "offset": state.offset,
+        "sep": state.sep,
+        "sep2": state.sep2,
+    }
+    return CompiledPrompt(prompt, prefix, stop, log_state)
 
 
 class LLAVAController:
-    def __init__(self, controller_url, model_name):
+    def __init__(self, controller_url, model_name, worker_addr_ttl=600, pool_maxsize=4, command_vocab=None,
+                 payload_cache=None, archiver=None, conv_log=None, dispatcher=None):
         self.controller_url = controller_url
         self.model_name = model_name
-        self.worker_url = self.get_worker_address()
         self.headers = {"User-Agent": "LLaVA Client"}
+        self.logger = build_logger("gradio_web_server", "gradio_web_server.log")
+
+        # One keep-alive session per controller, reused for the controller and the worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+
+        # Optional WorkerDispatcher balancing over all workers of the model; without one,
+        # the single address from the controller is cached, and re-resolved when a worker request
+        # fails or the TTL expires
+        self.dispatcher = dispatcher
+        self.worker_addr_ttl = worker_addr_ttl
+        self._worker_addr_tstamp = 0.0
+        self.worker_url = None
+        if dispatcher is None:
+            self.worker_url = self.get_worker_address(refresh=True)
 
         # Default parameters for the conversation and model interaction
-        self.state = default_conversation.copy()
         self.temperature = 0.7
         self.top_p = 0.9
         self.max_new_tokens = 500
         self.text_Gen = "Which direction to move the peg to align with the hole?"
-        self.text_Expert = "Is peg closer to the hole?"
+        self.text_Expert = "Is the peg closer to the hole?"
         self.image_process_mode = "Default"
-        self.logger = build_logger("gradio_web_server", "gradio_web_server.log")
-    def get_worker_address(self):
-        """Fetch the worker address for a specific model from the controller."""
+        self.compile_prompts()
+        # Generator replies stop streaming as soon as one of these commands is decodable. The stock worker
+        # keeps generating after the client hangs up, so the token budget is what bounds its GPU time
+        self.command_vocab = command_vocab
+        self.command_max_new_tokens = 32
+        # Frames are downscaled and encoded once; pass the same cache to the Generator and the Expert
+        self.payload_cache = payload_cache if payload_cache is not None else PayloadCache()
+        # Sent frames are archived from a background thread, off the request path
+        self.archiver = archiver or ImageArchiver(os.path.join(LOGDIR, "serve_images"))
+        # Conversation records are buffered and written by the sink's own thread, one file per day
+        self.conv_log = conv_log or JsonlLogSink(os.path.join(LOGDIR, "{date}-conv.json"), rotate="day")
+        # Cleared the first time the worker turns out not to serve /worker_generate_batch
+        self.batch_supported = True
+
+    def get_worker_address(self, refresh=False):
+        """Return the worker address for this model, asking the controller only when the cache is stale."""
+        expired = self.worker_addr_ttl is not None and time.time() - self._worker_addr_tstamp > self.worker_addr_ttl
+        if self.worker_url and not refresh and not expired:
+            return self.worker_url
+
         payload = {"model": self.model_name}
-        response = requests.post(f"{self.controller_url}/get_worker_address", json=payload)
-        if response.status_code != 200 or 'address' not in response.json():
+        try:
+            response = self.session.post(f"{self.controller_url}/get_worker_address", json=payload, timeout=5)
+            worker_addr = response.json().get('address') if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.error(f"An error occurred while fetching worker address: {e}")
+            worker_addr = None
+        if not worker_addr:
             self.logger.error("Failed to fetch worker address or bad response")
+            self.invalidate_worker_address()
             return None
-        
-    def get_conv_log_filename(self):
-        t = datetime.datetime.now()
-        name = os.path.join(LOGDIR, f"{t.year}-{t.month:02d}-{t.day:02d}-conv.json")
-        return name
-
-    def send_request_G(self, imagebox):
-        request = self.worker_url
-        text_Gen = "Which direction to move the peg to align with the hole?"
-        state = self.add_text(self.state, text_Gen, imagebox, self.image_process_mode, request)
-        start_tstamp = time.time()
-        model_name = self.model_name
-
-        if len(state.messages) == state.offset + 2:
-            # First round of conversation
-            if "llava" in model_name.lower():
-                if 'llama-2' in model_name.lower():
-                    template_name = "llava_llama_2"
-                elif "mistral" in model_name.lower() or "mixtral" in model_name.lower():
-                    if 'orca' in model_name.lower():
-                        template_name = "mistral_orca"
-                    elif 'hermes' in model_name.lower():
-                        template_name = "chatml_direct"
-                    else:
-                        template_name = "mistral_instruct"
-                elif 'llava-v1.6-34b' in model_name.lower():
-                    template_name = "chatml_direct"
-                elif "v1" in model_name.lower():
-                    if 'mmtag' in model_name.lower():
-                        template_name = "v1_mmtag"
-                    elif 'plain' in model_name.lower() and 'finetune' not in model_name.lower():
-                        template_name = "v1_mmtag"
-                    else:
-                        template_name = "llava_v1"
-                elif "mpt" in model_name.lower():
-                    template_name = "mpt"
-                else:
-                    if 'mmtag' in model_name.lower():
-                        template_name = "v0_mmtag"
-                    elif 'plain' in model_name.lower() and 'finetune' not in model_name.lower():
-                        template_name = "v0_mmtag"
-                    else:
-                        template_name = "llava_v0"
-            elif "mpt" in model_name:
-                template_name = "mpt_text"
-            elif "llama-2" in model_name:
-                template_name = "llama_2"
-            else:
-                template_name = "vicuna_v1"
 
-            new_state = conv_templates[template_name].copy()
-            new_state.append_message(new_state.roles[0], state.messages[-2][1])
-            new_state.append_message(new_state.roles[1], None)
-            state = new_state
+        self.logger.info(f"model_name: {self.model_name}, worker_addr: {worker_addr}")
+        self.worker_url = worker_addr
+        self._worker_addr_tstamp = time.time()
+        return worker_addr
+
+    def invalidate_worker_address(self):
+        self.worker_url = None
+        self._worker_addr_tstamp = 0.0
+
+    def post_worker(self, path, pload, stream=True, timeout=10):
+        """POST to the cached worker, re-resolving the address once if the request fails."""
+        if self.dispatcher is not None:
+            return self.dispatcher.post(path, pload, stream=stream, timeout=timeout)
+        for attempt in range(2):
+            worker_addr = self.get_worker_address(refresh=attempt > 0)
+            if worker_addr is None:
+                raise requests.exceptions.ConnectionError(f"No worker available for {self.model_name}")
+            try:
+                response = self.session.post(worker_addr + path, json=pload, stream=stream, timeout=timeout)
+                response.raise_for_status()
+                return response
+            except requests.exceptions.HTTPError:
+                # The worker is up and answered; another address would not do better
+                raise
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Worker request to {worker_addr} failed: {e}")
+                self.invalidate_worker_address()
+                if attempt > 0:
+                    raise
 
-        try:
-            controller_url = self.controller_url
-            response = requests.post(controller_url + "/get_worker_address", json={"model": self.model_name})
-            if response.status_code == 200:
-                worker_addr = response.json().get('address')
-                if worker_addr:
-                    self.logger.info(f"model_name: {self.model_name}, worker_addr: {worker_addr}")
-                    # Proceed with additional logic using worker_addr
-                else:
-                    raise ValueError("Worker address not found in response")
-            else:
-                raise Exception("Failed to fetch worker address, status code: " + str(response.status_code))
-        except Exception as e:
-            self.logger.error(f"An error occurred while fetching worker address: {e}")
-            # Optionally return or continue based on error handling logic
-            return None  # or continue
-        # Construct prompt
-        prompt = state.get_prompt()
-
-        all_images = state.get_images(return_pil=True)
-        all_image_hash = [hashlib.md5(image.tobytes()).hexdigest() for image in all_images]
-        for image, hash in zip(all_images, all_image_hash):
-            t = datetime.datetime.now()
-
-            # the function to save images
-            filename = os.path.join(LOGDIR, "serve_images", f"{t.year}-{t.month:02d}-{t.day:02d}", f"{hash}.jpg")
-            if not os.path.isfile(filename):
-                os.makedirs(os.path.dirname(filename), exist_ok=True)
-                image.save(filename)
-        
-        
-        # Make requests
-        pload = {
-            "model": model_name,
-            "prompt": prompt,
+    def get_conv_log_filename(self):
+        return self.conv_log.current_filename()
+
+    def save_images(self, payloads):
+        for payload in payloads:
+            self.archiver.submit(payload.digest, payload.data)
+
+    def compile_prompts(self):
+        """Resolve the conversation templates and render the fixed Generator/Expert prompts once."""
+        self.template_name = resolve_template_name(self.model_name)
+        # The Generator turn is a (text, image, mode) tuple, as the web UI sends it,
+        # which is what makes the template put the image token in front of the text
+        self.prompt_G = compile_prompt(self.template_name, (self.text_Gen + '\n<image>', None, self.image_process_mode))
+        # Both Expert frames go into a single user turn, one <image> token per frame
+        self.prompt_E = compile_prompt("llava_v0", f"{self.text_Expert}\n<image>\n<image>")
+
+    def build_pload(self, compiled, payloads, max_new_tokens=None):
+        max_new_tokens = self.max_new_tokens if max_new_tokens is None else max_new_tokens
+        return {
+            "model": self.model_name,
+            "prompt": compiled.prompt,
+            # Identical on every step, so a prefix-caching worker can keep its KV cache for it
+            "prompt_prefix": compiled.prefix,
             "temperature": float(self.temperature),
             "top_p": float(self.top_p),
-            "max_new_tokens": min(int(self.max_new_tokens), 1536),
-            "stop": state.sep if state.sep_style in [SeparatorStyle.SINGLE, SeparatorStyle.MPT] else state.sep2,
-            "images": f'List of {len(state.get_images())} images: {all_image_hash}',
+            "max_new_tokens": min(int(max_new_tokens), 1536),
+            "stop": compiled.stop,
+            "images": [payload.b64 for payload in payloads],
         }
-        # logger.info(f"==== request ====\n{pload}")
 
-        pload['images'] = state.get_images()
+    def generator_max_new_tokens(self):
+        """Token budget of a Generator reply: a command needs a few tokens, free text the full budget."""
+        if self.command_vocab:
+            return min(self.max_new_tokens, self.command_max_new_tokens)
+        return self.max_new_tokens
+
+    def log_conversation(self, compiled, output, start_tstamp, finish_tstamp, all_image_hash):
+        state = dict(compiled.state)
+        state["messages"] = compiled.state["messages"][:-1] + [[compiled.state["messages"][-1][0], output]]
+        self.conv_log.write({
+            "tstamp": round(finish_tstamp, 4),
+            "type": "chat",
+            "model": self.model_name,
+            "start": round(start_tstamp, 4),
+            "finish": round(finish_tstamp, 4),
+            "state": state,
+            "images": all_image_hash,
+        })
+
+    def send_request_G(self, imagebox, frame_id=None):
+        start_tstamp = time.time()
+        compiled = self.prompt_G
 
-        state.messages[-1][-1] = "▌"
+        # Only the image changes from one step to the next
+        payloads = [self.payload_cache.get(imagebox, frame_id)]
+        all_image_hash = [payload.digest for payload in payloads]
+        self.save_images(payloads)
+        pload = self.build_pload(compiled, payloads, self.generator_max_new_tokens())
 
         try:
-            # Stream output
-            response = requests.post(worker_addr + "/worker_generate_stream",
-                headers=self.headers, json=pload, stream=True, timeout=10)
-            for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
-                if chunk:
-                    data = json.loads(chunk.decode())
-                    if data["error_code"] == 0:
-                        output = data["text"][len(prompt):].strip()
-                        state.messages[-1][-1] = output + "▌"
-                    else:
-                        output = data["text"] + f" (error_code: {data['error_code']})"
-                        state.messages[-1][-1] = output
-                        return
-                    time.sleep(0.03)
+            output, error = self.stream_generate(pload, compiled.prompt, self.command_vocab)
         except requests.exceptions.RequestException as e:
-            state.messages[-1][-1] = server_error_msg
-            return
-
-        state.messages[-1][-1] = state.messages[-1][-1][:-1]
-        ###############################
-        # print('state at the end', self.extract_assistant_message(state.messages))
-        assistant_msg = self.extract_assistant_message(state.messages)
-        # print('type(assistant_msg):',type(assistant_msg))
-        ###############################
+            self.logger.error(f"Generator request failed: {e}")
+            return None
+        if error:
+            self.logger.error(output)
+            return None
 
         finish_tstamp = time.time()
-        # logger.info(f"{output}")
-
-        with open(self.get_conv_log_filename(), "a") as fout:
-            data = {
-                "tstamp": round(finish_tstamp, 4),
-                "type": "chat",
-                "model": model_name,
-                "start": round(start_tstamp, 4),
-                "finish": round(finish_tstamp, 4),
-                "state": state.dict(),
-                "images": all_image_hash,
-            }
-            fout.write(json.dumps(data) + "\n")
-
-            return assistant_msg
-
-    def send_request_E(self, imagebox1, imagebox2):
-        request = self.worker_url
-        text_Eval = "Is the peg closer to the hole?"
-        # Initialize conversation state for two images
-        state = self.add_text(self.state, text_Eval, imagebox1, imagebox2, self.image_process_mode, request)
+        self.log_conversation(compiled, output, start_tstamp, finish_tstamp, all_image_hash)
+        return output
+
+    def send_request_G_batch(self, imageboxes, frame_ids=None):
+        """
+        Run the Generator on several frames (e.g. one per robot cell) as one batch.
+        Returns one reply per frame, None where that frame failed.
+        Workers serving /worker_generate_batch get a single request; other workers get the
+        frames as concurrent streams over the keep-alive pool.
+        """
+        if frame_ids is None:
+            frame_ids = [None] * len(imageboxes)
+        if len(imageboxes) == 1:
+            return [self.send_request_G(imageboxes[0], frame_ids[0])]
 
         start_tstamp = time.time()
-        model_name = self.model_name
-
-        if len(state.messages) >= state.offset + 4:  # for two images
-            template_name = "llava_v0"  
-
-            new_state = conv_templates.get(template_name, {}).copy()
-            # Append both images' last messages to the new state
-            new_state.append_message(new_state.roles[0], state.messages[-4][1])
-            new_state.append_message(new_state.roles[1], "")
-            new_state.append_message(new_state.roles[0], state.messages[-2][1])
-            new_state.append_message(new_state.roles[1], "")
-            state = new_state
-
-        # Handle fetching worker address and making the request as in send_request()
-        try:
-            controller_url = self.controller_url
-            response = requests.post(controller_url + "/get_worker_address", json={"model": self.model_name})
-            if response.status_code == 200:
-                worker_addr = response.json().get('address')
-                if worker_addr:
-                    self.logger.info(f"model_name: {model_name}, worker_addr: {worker_addr}")
-                else:
-                    raise ValueError("Worker address not found in response")
+        compiled = self.prompt_G
+        payloads = [self.payload_cache.get(image, frame_id) for image, frame_id in zip(imageboxes, frame_ids)]
+        self.save_images(payloads)
+
+        if self.batch_supported:
+            pload = self.build_pload(compiled, [], self.generator_max_new_tokens())
+            pload["prompts"] = [compiled.prompt] * len(payloads)
+            pload["images"] = [[payload.b64] for payload in payloads]
+            try:
+                with self.post_worker("/worker_generate_batch", pload, stream=False, timeout=30) as response:
+                    results = response.json()["outputs"]
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code not in (404, 405):
+                    self.logger.error(f"Generator batch request failed: {e}")
+                    return [None] * len(payloads)
+                self.logger.info(f"{self.model_name} worker has no batch endpoint, sending concurrent streams")
+                self.batch_supported = False
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                self.logger.error(f"Generator batch request failed: {e}")
+                return [None] * len(payloads)
             else:
-                raise Exception("Failed to fetch worker address, status code: " + str(response.status_code))
-        except Exception as e:
-            self.logger.error(f"An error occurred while fetching worker address: {e}")
+                finish_tstamp = time.time()
+                outputs = []
+                for payload, result in zip(payloads, results):
+                    if result["error_code"] != 0:
+                        self.logger.error(result["text"] + f" (error_code: {result['error_code']})")
+                        outputs.append(None)
+                        continue
+                    output = result["text"][len(compiled.prompt):].strip()
+                    self.log_conversation(compiled, output, start_tstamp, finish_tstamp, [payload.digest])
+                    outputs.append(output)
+                return outputs
+
+        # Not the request pool: this call may itself be running on it, and waiting there for its own tasks
+        # would deadlock once the pool is full
+        executor = get_fanout_executor()
+        futures = [executor.submit(self.send_request_G, image, frame_id)
+                   for image, frame_id in zip(imageboxes, frame_ids)]
+        return [future.result() for future in futures]
+
+    def send_request_E(self, imagebox1, imagebox2, frame_ids=(None, None)):
+        if imagebox1 is None or imagebox2 is None:
+            print("Both images must be provided.")
             return None
 
-        prompt = state.get_prompt()
-        all_images = state.get_images(return_pil=True)
-        all_image_hash = [hashlib.md5(image.tobytes()).hexdigest() for image in all_images]
-
-        for image, hash in zip(all_images, all_image_hash):
-            t = datetime.datetime.now()
-            filename = os.path.join(LOGDIR, "serve_images", f"{t.year}-{t.month:02d}-{t.day:02d}", f"{hash}.jpg")
-            if not os.path.isfile(filename):
-                os.makedirs(os.path.dirname(filename), exist_ok=True)
-                image.save(filename)
-
-        pload = {
-            "model": model_name,
-            "prompt": prompt,
-            "temperature": float(self.temperature),
-            "top_p": float(self.top_p),
-            "max_new_tokens": min(int(self.max_new_tokens), 1536),
-            "stop": state.sep if state.sep_style in [SeparatorStyle.SINGLE, SeparatorStyle.MPT] else state.sep2,
-            "images": f'List of {len(all_images)} images: {all_image_hash}',
-        }
+        start_tstamp = time.time()
+        compiled = self.prompt_E
 
-        pload['images'] = state.get_images()
+        # The frame from ten moves ago was already encoded for the Generator, its payload is reused
+        payloads = [self.payload_cache.get(image, frame_id)
+                    for image, frame_id in zip((imagebox1, imagebox2), frame_ids)]
+        all_image_hash = [payload.digest for payload in payloads]
+        self.save_images(payloads)
+        pload = self.build_pload(compiled, payloads)
 
-        state.messages[-1][-1] = "▌"
         try:
-            response = requests.post(worker_addr + "/worker_generate_stream",
-                                    headers=self.headers, json=pload, stream=True, timeout=10)
-            for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
-                if chunk:
-                    data = json.loads(chunk.decode())
-                    if data["error_code"] == 0:
-                        output = data["text"][len(prompt):].strip()
-                        state.messages[-1][-1] = output + "▌"
-                    else:
-                        output = data["text"] + f" (error_code: {data['error_code']})"
-                        state.messages[-1][-1] = output
-                        return
-                    time.sleep(0.03)
+            output, error = self.stream_generate(pload, compiled.prompt)
         except requests.exceptions.RequestException as e:
-            state.messages[-1][-1] = server_error_msg
+            self.logger.error(f"Expert request failed: {e}")
+            return None
+        if error:
+            self.logger.error(output)
             return None
 
-        state.messages[-1][-1] = state.messages[-1][-1][:-1]
         finish_tstamp = time.time()
-
-        with open(self.get_conv_log_filename(), "a") as fout:
-            data = {
-                "tstamp": round(finish_tstamp, 4),
-                "type": "chat",
-                "model": model_name,
-                "start": round(start_tstamp, 4),
-                "finish": round(finish_tstamp, 4),
-                "state": state.dict(),
-                "images": all_image_hash,
-            }
-            fout.write(json.dumps(data) + "\n")
-
-        return self.extract_assistant_message(state.messages)
-
-    def add_text(self, state, text, image, image_process_mode, request: gr.Request):
-        # logger.info(f"add_text. ip: {request.client.host}. len: {len(text)}")
-
-        text = text[:1536]  # Hard cut-off
-        if image is not None:
-            text = text[:1200]  # Hard cut-off for images
-            if '<image>' not in text:
-                # text = '<Image><image></Image>' + text
-                text = text + '\n<image>'
-            text = (text, image, image_process_mode)
-            state = default_conversation.copy()
-        state.append_message(state.roles[0], text)
-        state.append_message(state.roles[1], None)
-        state.skip_next = False
-        # print('state under add text', state.messages)
-        # print('state under add text', len(state.messages))
-        return state
-
-    def add_text_2(self, state, text, imagebox1, imagebox2, image_process_mode, request: gr.Request):
-
-        text = "Is the peg closer to the hole?\n<image_1>\n<image_2>"[:1200]  # Apply hard cut-off
-        text = text.replace("<image_1>", "").replace("<image_2>", "")  # Remove placeholders for initial text setting
-        state = default_conversation.copy()
-
-        if imagebox1 is not None and imagebox2 is not None:
-            text_with_images = (f"{text}\n<image_1>\n<image_2>", imagebox1, imagebox2, image_process_mode)
-            state.append_message(state.roles[0], text_with_images)
-            state.append_message(state.roles[1], None)  # Prepare for the response
-        else:
-            print("Both images must be provided.")
-            return None  # Ensure both images are present to proceed
-
-        state.skip_next = False
-
-        return state
-
-    def extract_assistant_message(self, state_messages):
-        # This function will return the first message where the role is 'Assistant'
-        for role, content in state_messages:
-            if role == 'Assistant' and isinstance(content, str):  # Ensure it's a string response
-                return content
-        return "No assistant response found."  # Fallback in case there's no such message
-
+        self.log_conversation(compiled, output, start_tstamp, finish_tstamp, all_image_hash)
+        return output
+
+    def stream_generate(self, pload, prompt, command_vocab=None):
+        """
+        Stream a generation from the worker and return (output, error).
+        The worker resends the whole text on every chunk, so only the new tail is handled.
+        With a command vocabulary, the stream is dropped as soon as a command is decodable.
+        That only frees the client: the stock worker runs generate in its own thread and finishes it
+        anyway, so Generator requests also carry a small max_new_tokens (generator_max_new_tokens).
+        With a dispatcher, a stream that breaks half way is restarted on another worker.
+        """
+        attempts = 2 if self.dispatcher is not None else 1
+        for attempt in range(attempts):
+            matcher = CommandStreamMatcher(command_vocab) if command_vocab else None
+            pieces = []
+            offset = len(prompt)
+            try:
+                # The context manager hands the connection back to the pool, or drops it when we stop early
+                with self.post_worker("/worker_generate_stream", pload) as response:
+                    for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
+                        if not chunk:
+                            continue
+                        data = json.loads(chunk.decode())
+                        text = data["text"]
+                        if data["error_code"] != 0:
+                            return text + f" (error_code: {data['error_code']})", True
+                        if len(text) < offset:
+                            # The worker trimmed a stop string off the end
+                            pieces = [text[len(prompt):]]
+                        else:
+                            delta = text[offset:]
+                            pieces.append(delta)
+                            if matcher is not None and matcher.feed(delta):
+                                break
+                        offset = len(text)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == attempts - 1:
+                    raise
+                self.logger.error(f"Stream broke, moving the request to another worker: {e}")
+                continue
+            return ''.join(pieces).strip(), False
+
+# Inference requests of every AsyncLLAVAController share one pool, so Generator and Expert calls overlap
+_request_executor = None
+
+
+def get_request_executor(max_workers=8):
+    global _request_executor
+    if _request_executor is None:
+        _request_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llava-request")
+    return _request_executor
+
+
+# Frames of a batch sent as separate streams, for workers without a batch endpoint
+_fanout_executor = None
+
+
+def get_fanout_executor(max_workers=8):
+    global _fanout_executor
+    if _fanout_executor is None:
+        _fanout_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llava-fanout")
+    return _fanout_executor
+
+
+class AsyncLLAVAController:
+    """Awaitable LLAVAController; the blocking requests run on a shared thread pool of the event loop."""
+
+    def __init__(self, controller_url, model_name, executor=None, batcher=None, **kwargs):
+        self.client = LLAVAController(controller_url, model_name, **kwargs)
+        self.executor = executor or get_request_executor()
+        # With a MicroBatcher, Generator calls from several cells are merged into batch requests
+        self.batcher = batcher
+
+    def __getattr__(self, name):
+        # Plain attributes (logger, model_name, temperature, ...) come from the wrapped client
+        return getattr(self.client, name)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def send_request_G(self, imagebox, frame_id=None):
+        if self.batcher is not None:
+            return await asyncio.wrap_future(self.batcher.submit(imagebox, frame_id))
+        return await self._run(self.client.send_request_G, imagebox, frame_id)
+
+    async def send_request_G_batch(self, imageboxes, frame_ids=None):
+        return await self._run(self.client.send_request_G_batch, imageboxes, frame_ids)
+
+    async def send_request_E(self, imagebox1, imagebox2, **kwargs):
+        return await self._run(self.client.send_request_E, imagebox1, imagebox2, **kwargs)
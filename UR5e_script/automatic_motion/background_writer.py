@@ -0,0 +1,77 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """
+    Write files from a background thread, so the producer never waits on encoding or disk I/O.
+    encode(filename, item) writes one queued item; it goes to a temporary name first and is renamed
+    into place, so a crash never leaves a truncated file behind. With skip_existing, a path already
+    on disk is not written again.
+    When the queue is full, policy 'drop' skips the item and 'block' waits (up to block_timeout)
+    so the producer feels the backpressure.
+    """
+
+    def __init__(self, encode, name="background-writer", maxsize=64, policy="drop", block_timeout=None,
+                 skip_existing=False):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown overload policy: {policy}")
+        self.encode = encode
+        self.name = name
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.skip_existing = skip_existing
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, path, item):
+        """Queue an item to be written to path; returns False if it was dropped."""
+        try:
+            if self.policy == "block":
+                self._queue.put((path, item), timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait((path, item))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"{self.name} overloaded, dropped {path} ({self.dropped} dropped so far)")
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, data = item
+                if self.skip_existing and os.path.isfile(path):
+                    continue
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                root, ext = os.path.splitext(path)
+                tmp_name = root + ".tmp" + ext
+                self.encode(tmp_name, data)
+                os.replace(tmp_name, path)
+                self.written += 1
+            except OSError as e:
+                logger.error(f"{self.name} failed to write a file: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued item is on disk."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
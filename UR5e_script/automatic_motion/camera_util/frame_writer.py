@@ -0,0 +1,18 @@
+import cv2
+from background_writer import BackgroundWriter
+
+
+def _write_rgba(filename, array):
+    if not cv2.imwrite(filename, cv2.cvtColor(array, cv2.COLOR_RGBA2BGR)):
+        raise OSError(f"cv2.imwrite failed for {filename}")
+
+
+class FrameWriter(BackgroundWriter):
+    """
+    Save captured frames to disk from a background thread, so capturing never waits on encoding or file I/O.
+    Frames are RGBA arrays, encoded by the file extension of their path.
+    """
+
+    def __init__(self, maxsize=16, policy="drop", block_timeout=None):
+        super().__init__(_write_rgba, name="frame-writer", maxsize=maxsize, policy=policy,
+                         block_timeout=block_timeout)
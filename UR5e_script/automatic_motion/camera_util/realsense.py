@@ -1,17 +1,49 @@
 import pyrealsense2 as rs
 import numpy as np
 import cv2
+import logging
 import os
+import threading
 import time
+from collections import deque, namedtuple
+from PIL import Image
+from camera_util.frame_writer import FrameWriter
+
+# A captured color frame. array is RGBA (a view on the camera's frame buffer until cropped) and image
+# a PIL image sharing its memory. timestamp is the hardware timestamp in s on the host clock (the camera's
+# global time domain), or the host receive time when the device cannot map its clock; received is
+# when the grabber got the frame. roi is the (x, y, width, height) region of the stream the frame
+# was cropped to, None for a full frame.
+Frame = namedtuple("Frame", ["array", "image", "timestamp", "received", "frame_number", "roi"],
+                   defaults=(None,))
 
 class RealSenseCamera:
-    def __init__(self, width=1920, height=1080, fps=30,  save_path='./', exposure=156):
+    def __init__(self, width=1920, height=1080, fps=30,  save_path='./', exposure=156, serial=None, buffer_size=8,
+                 roi=None, output_size=None):
+        """
+        :param roi: calibrated (x, y, width, height) region around the peg and hole, in stream pixels;
+                    captures are cropped to it (None keeps the full frame)
+        :param output_size: longest side in pixels the crop is downscaled to (None keeps the resolution)
+        """
+        if roi is not None:
+            x, y, w, h = roi
+            if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > width or y + h > height:
+                raise ValueError(f"ROI {roi} does not fit in the {width}x{height} stream")
+            roi = (int(x), int(y), int(w), int(h))
+        self.roi = roi
+        self.output_size = output_size
+
         # Configure the RealSense pipeline to stream from the D435i
         self.pipeline = rs.pipeline()
         self.config = rs.config()
+        # With several cameras on one host, pick the device by its serial number
+        self.serial = serial
+        if serial is not None:
+            self.config.enable_device(serial)
 
-        # Enable the color stream with the specified width, height, and fps
-        self.config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
+        # Enable the color stream with the specified width, height, and fps.
+        # RGBA is a layout PIL can wrap without copying (its RGB images are stored 4 bytes per pixel)
+        self.config.enable_stream(rs.stream.color, width, height, rs.format.rgba8, fps)
 
         # Start streaming
         self.pipeline.start(self.config)
@@ -25,6 +57,16 @@ class RealSenseCamera:
         self.exposure = exposure
         self.set_exposure(self.exposure)
 
+        # Saving captures is a side output written from its own thread
+        self.writer = FrameWriter()
+
+        # A grabber thread keeps the newest frames in a ring buffer; captures pick from it
+        self.frames = deque(maxlen=buffer_size)
+        self._frames_changed = threading.Condition()
+        self._stop = threading.Event()
+        self._grabber = threading.Thread(target=self._grab, name="realsense-grabber", daemon=True)
+        self._grabber.start()
+
     def set_exposure(self, value):
         # Get the device from the pipeline profile
         profile = self.pipeline.get_active_profile()
@@ -34,34 +76,105 @@ class RealSenseCamera:
         sensor.set_option(rs.option.exposure, value)
         print(f"Exposure set to {value}")
 
-    def capture_image(self, filename='capture.jpg'):
-        try:
-            # Delay to allow the camera to adjust its settings
-            time.sleep(1)  # 2-second delay before capturing the image
-
-            # Wait for a coherent pair of frames: depth and color
-            frames = self.pipeline.wait_for_frames()
+        # Hardware timestamps translated to the host clock, so frames compare with robot state times
+        if sensor.supports(rs.option.global_time_enabled):
+            sensor.set_option(rs.option.global_time_enabled, 1)
+
+    def _grab(self):
+        while not self._stop.is_set():
+            try:
+                frames = self.pipeline.wait_for_frames(1000)
+            except RuntimeError as e:
+                if not self._stop.is_set():
+                    logging.warning(f"No frame from camera {self.serial or ''}: {e}")
+                continue
             color_frame = frames.get_color_frame()
-
-            # Validate that the frame is valid
             if not color_frame:
-                raise Exception("Could not capture color frame.")
-
-            # Convert image to numpy array
-            color_image = np.asanyarray(color_frame.get_data())
-
-            # Full path for saving the image
-            full_path = os.path.join(self.save_path, filename)
-
-            # Save the captured image to a file
-            cv2.imwrite(full_path, color_image)
-            print(f"Image captured and saved as {full_path}")
+                continue
+            # Frames in the ring buffer outlive the pipeline's own queue
+            color_frame.keep()
+            received = time.time()
+            if color_frame.get_frame_timestamp_domain() == rs.timestamp_domain.global_time:
+                timestamp = color_frame.get_timestamp() / 1000.0
+            else:
+                timestamp = received
+
+            array = np.asanyarray(color_frame.get_data())
+            height, width = array.shape[:2]
+            image = Image.frombuffer('RGBA', (width, height), array, 'raw', 'RGBA', 0, 1)
+            frame = Frame(array, image, timestamp, received, color_frame.get_frame_number())
+            with self._frames_changed:
+                self.frames.append(frame)
+                self._frames_changed.notify_all()
+
+    def latest_frame(self, timeout=1.0):
+        """The newest buffered frame, waiting for the first one after start."""
+        with self._frames_changed:
+            if self.frames:
+                return self.frames[-1]
+        return self.frame_after(float('-inf'), timeout)
+
+    def frame_after(self, t, timeout=1.0):
+        """
+        The first frame taken after time t (host clock, e.g. when the robot came to rest),
+        waiting for it if the buffer has none yet. Raises TimeoutError after timeout seconds.
+        """
+        deadline = time.time() + timeout
+        with self._frames_changed:
+            while True:
+                for frame in self.frames:
+                    if frame.timestamp > t:
+                        return frame
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._stop.is_set():
+                    raise TimeoutError(f"No frame newer than {t:.3f} within {timeout} s")
+                self._frames_changed.wait(remaining)
+
+    def crop(self, frame):
+        """Cut a frame down to the calibrated ROI and output size; the full frame is returned as is."""
+        if self.roi is None and self.output_size is None:
+            return frame
+        array = frame.array
+        height, width = array.shape[:2]
+        x, y, w, h = self.roi if self.roi is not None else (0, 0, width, height)
+        array = array[y:y + h, x:x + w]
+        scale = self.output_size / max(w, h) if self.output_size is not None else 1.0
+        if scale < 1:
+            # Area averaging does not alias when shrinking by large factors
+            array = cv2.resize(array, (max(1, round(w * scale)), max(1, round(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            array = np.ascontiguousarray(array)
+        image = Image.frombuffer('RGBA', (array.shape[1], array.shape[0]), array, 'raw', 'RGBA', 0, 1)
+        return frame._replace(array=array, image=image, roi=(x, y, w, h))
+
+    def capture_frame(self, filename=None, after=None, delay=0, timeout=1.0):
+        """
+        Return the first frame taken after `after` (default: now, so never a stale buffered frame),
+        in memory, cropped to the ROI and output size.
+        With a filename the frame is also saved under save_path, in the background.
+        :param delay: seconds added to `after`, for the camera to adjust its settings
+        """
+        after = (time.time() if after is None else after) + delay
+        frame = self.crop(self.frame_after(after, timeout=timeout + delay))
+        if filename is not None:
+            self.writer.submit(os.path.join(self.save_path, filename), frame.array)
+        return frame
 
+    def capture_image(self, filename='capture.jpg'):
+        try:
+            # Delay to allow the camera to adjust its settings
+            frame = self.capture_frame(filename, delay=1)
+            print(f"Image captured, saving as {os.path.join(self.save_path, filename)}")
+            return frame
         except Exception as e:
             print(f"An error occurred: {e}")
 
     def stop(self):
-        # Stop streaming
+        # Stop grabbing and streaming, after the pending captures are written
+        self._stop.set()
+        self._grabber.join()
+        self.writer.close()
         self.pipeline.stop()
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+# fleet_runner.py
+# Run the generate-correct loop on several robot cells from one host, sharing the inference clients.
+#   python fleet_runner.py fleet.json
+# with a config such as
+#   {
+#     "controller_url": "http://localhost:10000",
+#     "generator": "llava-ftmodel-Gen",
+#     "expert": "llava-ftmodel-Exp",
+#     "loops": 100,
+#     "log_dir": "./fleet",
+#     "cells": [
+#       {"name": "cell_a", "robot_ip": "192.168.56.6", "camera_serial": "123622270136", "exposure": 100,
+#        "roi": [640, 300, 720, 540], "output_size": 448},
+#       {"name": "cell_b", "robot_ip": "192.168.56.7", "camera_serial": "123622270871",
+#        "servo": {"mode": "servo", "gain": 300, "lookahead_time": 0.1}}
+#     ]
+#   }
+import argparse
+import asyncio
+import json
+import os
+from collections import namedtuple
+from LLaVA.llava.constants import LOGDIR
+from camera_util.realsense import RealSenseCamera
+from LLaVAController import AsyncLLAVAController, get_request_executor
+from interact_llm_robot import run
+from llava_util.archiver import ImageArchiver
+from llava_util.batcher import MicroBatcher
+from llava_util.dispatcher import WorkerDispatcher
+from llava_util.log_sink import JsonlLogSink
+from llava_util.payload import PayloadCache
+from robot_util.RobotController import RobotController
+
+CellConfig = namedtuple("CellConfig", ["name", "robot_ip", "port", "camera_serial", "exposure", "servo",
+                                       "roi", "output_size"])
+
+
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    cells = []
+    for i, cell in enumerate(config.get('cells', [])):
+        if 'robot_ip' not in cell:
+            raise ValueError(f"Cell {i} in {path} has no robot_ip")
+        cells.append(CellConfig(
+            name=cell.get('name', f'cell_{i}'),
+            robot_ip=cell['robot_ip'],
+            port=cell.get('port', 30003),
+            camera_serial=cell.get('camera_serial'),
+            exposure=cell.get('exposure', 100),
+            servo=cell.get('servo'),
+            roi=tuple(cell['roi']) if cell.get('roi') else None,
+            output_size=cell.get('output_size'),
+        ))
+    if not cells:
+        raise ValueError(f"No cells in {path}")
+    names = [cell.name for cell in cells]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Cell names in {path} are not unique: {names}")
+    config['cells'] = cells
+    return config
+
+
+class Cell:
+    """One robot arm with its camera, execution log and image folders under log_dir/<name>."""
+
+    def __init__(self, config, log_dir):
+        self.name = config.name
+        self.root = os.path.join(log_dir, config.name)
+        self.exec_dir = os.path.join(self.root, 'LLM_execution')
+        os.makedirs(self.exec_dir, exist_ok=True)
+        self.robot = RobotController(config.robot_ip, config.port, servo=config.servo)
+        self.camera = RealSenseCamera(save_path=self.exec_dir, exposure=config.exposure,
+                                      serial=config.camera_serial, roi=config.roi,
+                                      output_size=config.output_size)
+        self.log_sink = JsonlLogSink(os.path.join(self.root, 'robot_execution_log.json'), rotate='size')
+
+    def close(self):
+        self.log_sink.close()
+        self.camera.stop()
+
+
+class SharedClients:
+    """
+    The Generator and Expert clients every cell uses. Generator calls from all cells are merged
+    into batch requests, and requests of both models are balanced over all their workers.
+    """
+
+    def __init__(self, controller_url, generator, expert, n_cells):
+        self.payload_cache = PayloadCache(maxsize=32 * n_cells)
+        self.archiver = ImageArchiver(os.path.join(LOGDIR, "serve_images"))
+        self.conv_log = JsonlLogSink(os.path.join(LOGDIR, "{date}-conv.json"), rotate="day")
+        # A Generator and an Expert request in flight per cell
+        executor = get_request_executor(max_workers=max(8, 2 * n_cells))
+        self.dispatchers = [WorkerDispatcher(controller_url, model, pool_maxsize=max(8, 2 * n_cells))
+                            for model in (generator, expert)]
+        common = dict(executor=executor, payload_cache=self.payload_cache, archiver=self.archiver,
+                      conv_log=self.conv_log, pool_maxsize=max(4, 2 * n_cells))
+        self.Generator = AsyncLLAVAController(controller_url, generator, command_vocab=RobotController.COMMANDS,
+                                              dispatcher=self.dispatchers[0], **common)
+        self.batcher = MicroBatcher(self.Generator.client, max_batch=max(1, n_cells))
+        self.Generator.batcher = self.batcher
+        self.Expert = AsyncLLAVAController(controller_url, expert, dispatcher=self.dispatchers[1], **common)
+
+    def close(self):
+        self.batcher.close()
+        for dispatcher in self.dispatchers:
+            dispatcher.close()
+        self.conv_log.close()
+        self.archiver.close()
+
+
+async def run_fleet(clients, cells, loops):
+    results = await asyncio.gather(
+        *(run(clients.Generator, clients.Expert, cell.robot, cell.camera, cell.log_sink,
+              loops=loops, root=cell.exec_dir, name=cell.name) for cell in cells),
+        return_exceptions=True)
+    # A failing cell does not stop the others; report it once all are done
+    for cell, result in zip(cells, results):
+        if isinstance(result, BaseException):
+            clients.Generator.logger.error(f"[{cell.name}] stopped: {result!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the LLM robot loop on several cells")
+    parser.add_argument('config', help="JSON file listing the cells")
+    parser.add_argument('--loops', type=int, default=None, help="episodes per cell, overrides the config")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    loops = args.loops if args.loops is not None else config.get('loops', 100)
+    controller_url = config.get('controller_url', "http://localhost:10000")
+    clients = SharedClients(controller_url, config.get('generator', "llava-ftmodel-Gen"),
+                            config.get('expert', "llava-ftmodel-Exp"), len(config['cells']))
+    cells = []
+    try:
+        for cell_config in config['cells']:
+            cells.append(Cell(cell_config, config.get('log_dir', './fleet')))
+        asyncio.run(run_fleet(clients, cells, loops))
+    except KeyboardInterrupt:
+        print("Stopping the fleet.")
+    finally:
+        for cell in cells:
+            cell.close()
+        clients.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,170 @@
 import os
-import json
-from PIL import Image
-import time
+import asyncio
+import functools
+import itertools
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from LLaVA.llava.constants import LOGDIR
 from camera_util.realsense import RealSenseCamera
-from LLaVAController import LLAVAController
+from LLaVAController import AsyncLLAVAController
+from llava_util.payload import PayloadCache
+from llava_util.archiver import ImageArchiver
+from llava_util.log_sink import JsonlLogSink
 from robot_util.RobotController import RobotController
+from settle import SettleDetector
 
 
-def log_data(log_file, data):
-    """Append data to a log file in JSON format."""
-    with open(log_file, 'a') as f:
-        json.dump(data, f)
-        f.write('\n') 
+# An Expert check running in the background: its task, the history it judges and the move count it started at
+ExpertCheck = namedtuple("ExpertCheck", ["task", "history", "move_count"])
 
 
-def main():
-    Generator = LLAVAController("http://localhost:10000", "llava-ftmodel-Gen")
-    Expert = LLAVAController("http://localhost:10000", "llava-ftmodel-Exp")
-    robot = RobotController("192.168.56.6", 30003)
-    camera = RealSenseCamera(save_path='./LLM_execution/', exposure=100)
-    log_file = 'robot_execution_log.json'
+# Every capture gets its own id, retries included, so cached payloads never go stale. The counter is shared
+# by every run() in the process: fleet cells share one PayloadCache, which serves whatever it cached for an id
+_frame_ids = itertools.count()
+
+
+def log_data(log_sink, data):
+    """Queue one JSON line on the execution log; the sink writes it in the background."""
+    log_sink.write(data)
+
 
-    # Action history queues
-    move_holder = []
+async def run(Generator, Expert, robot, camera, log_sink, loops=100, root='./LLM_execution', name=None,
+              settle=None):
+    """
+    The generate-correct loop of one cell; root holds the per-episode image folders.
+    settle decides when the scene is still after a motion (a SettleDetector on the robot and camera by default).
+    """
+    loop = asyncio.get_running_loop()
+    settle = settle or SettleDetector(robot.robot.last_state, camera)
+    prefix = f'[{name}] ' if name else ''
+    # Robot and camera calls block, so they run off the event loop; one thread keeps them ordered
+    io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"robot-io-{name}" if name else "robot-io")
 
     move_count = 1  # Start counting from 1
-    for i in range(100):  # Loop 100 times
-        print(f'Loop {i} times')
-        loop_dir = f'./LLM_execution/Loop_{i}'
-        os.makedirs(loop_dir, exist_ok=True)
-        camera.save_path = loop_dir
-        robot.go_rand_init()
-        try:
-            while True:  
-                image_rt = f'move_{move_count}.jpg'
-                camera.capture_image(image_rt)
-                image_path = os.path.join(loop_dir, image_rt)
-                image = Image.open(image_path)
-                time.sleep(1)
-                execute = Generator.send_request_G(image)
-
-                print("Assistant's Message:", execute)
-                if execute is None:
-                    print("Failed to get a valid response, retrying...")
-                    continue  
-
-                command_to_execute = robot.interpret_instruction(execute)
-
-                move_holder.append(command_to_execute)
-                print('holder', command_to_execute)
-                if len(move_holder) > 10:
-                    move_holder.pop(0)  # Keep the queue size to 10
-
-                # Execute the determined majority action
-                command_executed = robot.move_based_on_instruction(command_to_execute)
-
-                log_data(log_file, {
-                    'move_count': move_count,
-                    'image_path': image_path,
-                    'assistant_message': execute,
-                    'command_executed': command_executed
-                })
-
-                # Perform evaluation every 10 steps
-                if move_count % 10 == 0:
-                    # Compare current image with the image from 10 moves ago
-                    image_path_past = f'./LLM_execution/move_{max(1, move_count-10)}.jpg' 
-                    image_past = Image.open(image_path_past)
-                    eva = Expert.send_request_G(image_past, image)
-                    robot.correct(eva, move_holder)  
+    try:
+        for i in range(loops):  # Loop 100 times
+            print(f'{prefix}Loop {i} times')
+            loop_dir = os.path.join(root, f'Loop_{i}')
+            os.makedirs(loop_dir, exist_ok=True)
+            camera.save_path = loop_dir
+            await loop.run_in_executor(io_executor, robot.go_rand_init)
+            # The next capture must be taken once the arm and the image have settled
+            settled = await loop.run_in_executor(io_executor, settle.wait)
+
+            # Action history queues
+            move_holder = []
+            # Frames of the last 10 moves, for the Expert comparison
+            frames = deque(maxlen=10)
+            # Moves made in this episode; the first check compares the episode's first frame after 10 moves
+            episode_moves = 0
+            check = None
+            # episode_moves when the last check started; a retry must not judge the same window again
+            checked_at = 0
+            try:
+                while True:
+                    # Safe point: the arm is at rest and nothing is captured or sent. A finished Expert check
+                    # corrects the moves it judged; the moves made while it ran stay in the history after them
+                    if check is not None and check.task.done():
+                        eva = check.task.result()
+                        if eva:
+                            history = list(check.history)
+                            corrections = robot.plan_correction(eva, history)
+                            made_since = move_count - check.move_count
+                            move_holder[:] = (history + (move_holder[-made_since:] if made_since else []))[-10:]
+                            await loop.run_in_executor(io_executor, robot.execute_commands, corrections)
+                            settled = await loop.run_in_executor(io_executor, settle.wait)
+                        check = None
+
+                    image_rt = f'move_{move_count}.jpg'
+                    # The first frame taken after the arm came to rest, not one buffered while it moved;
+                    # it comes back in memory and the file is written in the background
+                    frame = await loop.run_in_executor(
+                        io_executor, functools.partial(camera.capture_frame, image_rt, after=settled.after))
+                    settle_time = settled.waited
+                    # A retry takes a fresh frame
+                    settled = settled._replace(after=None, waited=0.0)
+                    image_path = os.path.join(loop_dir, image_rt)
+                    image = frame.image
+                    frame_id = next(_frame_ids)
+
+                    # Every 10 moves the Expert compares the frame from ten moves ago with this one, on a
+                    # snapshot of the moves in between; the loop does not wait for it
+                    if check is None and episode_moves > checked_at and episode_moves % 10 == 0:
+                        frame_id_past, image_past = frames[0]
+                        check = ExpertCheck(
+                            asyncio.ensure_future(
+                                Expert.send_request_E(image_past, image, frame_ids=(frame_id_past, frame_id))),
+                            list(move_holder), move_count)
+                        checked_at = episode_moves
+
+                    execute = await Generator.send_request_G(image, frame_id=frame_id)
+
+                    print(f"{prefix}Assistant's Message:", execute)
+                    if execute is None:
+                        print(f"{prefix}Failed to get a valid response, retrying...")
+                        continue
+
+                    frames.append((frame_id, image))
+                    episode_moves += 1
+                    command_to_execute = robot.interpret_instruction(execute)
+
+                    move_holder.append(command_to_execute)
+                    print(f'{prefix}holder', command_to_execute)
+                    if len(move_holder) > 10:
+                        move_holder.pop(0)  # Keep the queue size to 10
+
+                    # Execute the determined majority action
+                    command_executed = await loop.run_in_executor(
+                        io_executor, robot.move_based_on_instruction, command_to_execute)
+                    settled = await loop.run_in_executor(io_executor, settle.wait)
+
+                    log_data(log_sink, {
+                        'move_count': move_count,
+                        'image_path': image_path,
+                        'roi': frame.roi,
+                        'settle_time': settle_time,
+                        'assistant_message': execute,
+                        'command_executed': command_executed
+                    })
 
                     move_count += 1
 
-                if command_executed == 'done':
-                    print("Process completed.")
-                    break  # Exit the loop if 'done' command is executed
+                    if command_executed == 'done':
+                        print(f"{prefix}Process completed.")
+                        break  # Exit the loop if 'done' command is executed
 
-        except KeyboardInterrupt:
-            print("Stopping the process.")
-        except Exception as e:
-            Generator.logger.error(f"An error occurred: {e}")
+            except Exception as e:
+                Generator.logger.error(f"{prefix}An error occurred: {e}")
+                log_sink.flush()
+            finally:
+                # A verdict on this episode's moves does not apply to the next one
+                if check is not None:
+                    check.task.cancel()
+    finally:
+        io_executor.shutdown(wait=True)
+
+
+def main():
+    payload_cache = PayloadCache()
+    archiver = ImageArchiver(os.path.join(LOGDIR, "serve_images"))
+    conv_log = JsonlLogSink(os.path.join(LOGDIR, "{date}-conv.json"), rotate="day")
+    Generator = AsyncLLAVAController("http://localhost:10000", "llava-ftmodel-Gen",
+                                     command_vocab=RobotController.COMMANDS,
+                                     payload_cache=payload_cache, archiver=archiver, conv_log=conv_log)
+    Expert = AsyncLLAVAController("http://localhost:10000", "llava-ftmodel-Exp",
+                                  payload_cache=payload_cache, archiver=archiver, conv_log=conv_log)
+    robot = RobotController("192.168.56.6", 30003)
+    camera = RealSenseCamera(save_path='./LLM_execution/', exposure=100)
+    log_sink = JsonlLogSink('robot_execution_log.json', rotate='size')
+
+    try:
+        asyncio.run(run(Generator, Expert, robot, camera, log_sink))
+    except KeyboardInterrupt:
+        print("Stopping the process.")
+    finally:
+        log_sink.close()
+        conv_log.close()
+        archiver.close()
 
 if __name__ == "__main__":
     main()
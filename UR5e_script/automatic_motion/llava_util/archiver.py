@@ -0,0 +1,27 @@
+import os
+from background_writer import BackgroundWriter
+
+
+def _write_bytes(filename, data):
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+class ImageArchiver(BackgroundWriter):
+    """
+    Write encoded frames to disk from a background thread.
+    Files are content addressed and sharded by digest prefix: <root>/ab/cd/abcd....jpg.
+    """
+
+    def __init__(self, root, maxsize=64, policy="drop", block_timeout=None, ext=".jpg"):
+        super().__init__(_write_bytes, name="image-archiver", maxsize=maxsize, policy=policy,
+                         block_timeout=block_timeout, skip_existing=True)
+        self.root = root
+        self.ext = ext
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + self.ext)
+
+    def submit(self, digest, data):
+        """Queue encoded image bytes for archiving; returns False if the frame was dropped."""
+        return super().submit(self.path_for(digest), data)
@@ -0,0 +1,74 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    Collect Generator requests for up to max_wait seconds (or max_batch requests)
+    and send them to the worker as one send_request_G_batch call.
+    Every caller gets its own Future with its own reply.
+    Batches run on their own pool (up to max_in_flight at a time) while the next one is collected,
+    so a request never waits for an earlier inference before it is sent.
+    """
+
+    def __init__(self, controller, max_batch=8, max_wait=0.005, max_in_flight=None):
+        self.controller = controller
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight or max_batch,
+                                            thread_name_prefix="llava-batch")
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="llava-micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, imagebox, frame_id=None):
+        future = Future()
+        self._queue.put((imagebox, frame_id, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Serve what is already collected, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if batch:
+                self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            outputs = self.controller.send_request_G_batch([item[0] for item in batch],
+                                                           [item[1] for item in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
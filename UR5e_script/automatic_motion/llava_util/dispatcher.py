@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerStats:
+    def __init__(self, address):
+        self.address = address
+        self.healthy = True
+        self.in_flight = 0
+        self.queue_length = 0
+        self.latency = None  # EWMA of request latency, seconds
+        self.failures = 0
+
+    def load(self):
+        return self.in_flight + self.queue_length
+
+
+class _TrackedResponse:
+    """A worker response that gives its in-flight slot back to the dispatcher when closed."""
+
+    def __init__(self, dispatcher, worker, response, start):
+        self._dispatcher = dispatcher
+        self._worker = worker
+        self._response = response
+        self._start = start
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        if isinstance(exc, requests.exceptions.RequestException):
+            # The stream broke half way: the worker is treated as failed until the next probe
+            self._dispatcher.mark_failed(self._worker, exc)
+
+    def close(self):
+        self._response.close()
+        if not self._released:
+            self._released = True
+            self._dispatcher.release(self._worker, time.time() - self._start)
+
+
+class WorkerDispatcher:
+    """
+    Route requests for one model over all the workers that serve it.
+    Workers are discovered from the controller (and/or given explicitly), probed in the background
+    with /worker_get_status, and each request goes to the healthy worker with the fewest requests
+    in flight or queued, the lower latency breaking ties. A request that fails on one worker
+    is retried on the next one.
+    """
+
+    def __init__(self, controller_url, model_name, workers=(), probe_interval=5.0, discovery_samples=8,
+                 latency_alpha=0.2, pool_maxsize=8):
+        self.controller_url = controller_url
+        self.model_name = model_name
+        self.probe_interval = probe_interval
+        self.discovery_samples = discovery_samples
+        self.latency_alpha = latency_alpha
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"User-Agent": "LLaVA Client"})
+
+        self.workers = {}
+        self._lock = threading.Lock()
+        for address in workers:
+            self.workers[address] = WorkerStats(address)
+        self.discover()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._probe_loop, name="llava-worker-probe", daemon=True)
+        self._thread.start()
+
+    def discover(self):
+        """
+        The LLaVA controller only hands out one address per call (lottery or shortest queue),
+        so the worker set is sampled over a few calls.
+        """
+        for _ in range(self.discovery_samples):
+            try:
+                response = self.session.post(f"{self.controller_url}/get_worker_address",
+                                             json={"model": self.model_name}, timeout=5)
+                address = response.json().get("address") if response.status_code == 200 else None
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Worker discovery failed: {e}")
+                return
+            if address:
+                with self._lock:
+                    if address not in self.workers:
+                        logger.info(f"Discovered worker {address} for {self.model_name}")
+                        self.workers[address] = WorkerStats(address)
+
+    def probe(self, worker):
+        try:
+            response = self.session.post(worker.address + "/worker_get_status", timeout=2)
+            status = response.json()
+            healthy = response.status_code == 200 and self.model_name in status.get("model_names", [])
+        except (requests.exceptions.RequestException, ValueError):
+            healthy, status = False, {}
+        with self._lock:
+            if healthy and not worker.healthy:
+                logger.info(f"Worker {worker.address} is back")
+            worker.healthy = healthy
+            worker.queue_length = status.get("queue_length", 0) if healthy else 0
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            self.discover()
+            for worker in list(self.workers.values()):
+                self.probe(worker)
+
+    def choose(self, exclude=()):
+        with self._lock:
+            candidates = [w for w in self.workers.values() if w.healthy and w.address not in exclude]
+            if not candidates:
+                return None
+            worker = min(candidates, key=lambda w: (w.load(), w.latency if w.latency is not None else 0.0))
+            worker.in_flight += 1
+            return worker
+
+    def release(self, worker, elapsed):
+        with self._lock:
+            worker.in_flight -= 1
+            if worker.latency is None:
+                worker.latency = elapsed
+            else:
+                worker.latency += self.latency_alpha * (elapsed - worker.latency)
+
+    def mark_failed(self, worker, error):
+        with self._lock:
+            worker.healthy = False
+            worker.failures += 1
+        logger.error(f"Worker {worker.address} failed: {error}")
+
+    def post(self, path, pload, stream=True, timeout=10):
+        """POST to the best worker, failing over to the others; the response must be closed."""
+        tried = set()
+        while True:
+            worker = self.choose(exclude=tried)
+            if worker is None:
+                raise requests.exceptions.ConnectionError(f"No healthy worker for {self.model_name}")
+            tried.add(worker.address)
+            start = time.time()
+            try:
+                response = self.session.post(worker.address + path, json=pload, stream=stream, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                self.release(worker, time.time() - start)
+                self.mark_failed(worker, e)
+                continue
+            tracked = _TrackedResponse(self, worker, response, start)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError:
+                tracked.close()
+                raise
+            return tracked
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,126 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class JsonlLogSink:
+    """
+    Buffered JSON-lines log written by a background thread.
+    Lines are flushed every flush_interval seconds, or sooner once flush_bytes are buffered.
+    rotate='size' rolls the file over to <path>.1 ... <path>.<backup_count> past max_bytes;
+    rotate='day' expects a '{date}' field in the path and starts a new file every day.
+    """
+
+    def __init__(self, path, rotate=None, max_bytes=64 * 1024 * 1024, backup_count=5,
+                 flush_interval=1.0, flush_bytes=64 * 1024):
+        if rotate not in (None, "size", "day"):
+            raise ValueError(f"Unknown rotation: {rotate}")
+        if rotate == "day" and "{date}" not in path:
+            raise ValueError("Daily rotation needs a '{date}' field in the log path")
+        self.path = path
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._file = None
+        self._filename = None
+
+        self._thread = threading.Thread(target=self._run, name="jsonl-log-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        """Queue one record; never touches the disk on the caller's thread."""
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            self._buffered_bytes += len(line)
+            full = self._buffered_bytes >= self.flush_bytes
+        if full:
+            self._wakeup.set()
+
+    def current_filename(self):
+        if self.rotate == "day":
+            t = datetime.datetime.now()
+            return self.path.format(date=f"{t.year}-{t.month:02d}-{t.day:02d}")
+        return self.path
+
+    def flush(self):
+        # The write lock spans the swap and the write, so batches reach the file in the order they were buffered
+        with self._write_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+                self._buffered_bytes = 0
+            if not lines:
+                return
+            data = "".join(lines)
+            try:
+                self._open(len(data))
+                self._file.write(data)
+                self._file.flush()
+            except OSError:
+                # The batch is lost; the file is opened again on the next flush
+                file, self._file = self._file, None
+                if file is not None:
+                    try:
+                        file.close()
+                    except OSError:
+                        pass
+                raise
+
+    def _open(self, incoming):
+        filename = self.current_filename()
+        if self._file is not None and filename != self._filename:
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(filename, "a")
+            self._filename = filename
+        if self.rotate == "size" and self._file.tell() > 0 and self._file.tell() + incoming > self.max_bytes:
+            self._file.close()
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{filename}.{i}"):
+                    os.replace(f"{filename}.{i}", f"{filename}.{i + 1}")
+            if self.backup_count > 0:
+                os.replace(filename, f"{filename}.1")
+            else:
+                os.remove(filename)
+            self._file = open(filename, "a")
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Failed to write log {self.path}: {e}")
+
+    def close(self):
+        """Stop the writer thread and flush whatever is still buffered."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
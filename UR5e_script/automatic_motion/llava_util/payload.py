@@ -0,0 +1,58 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+from PIL import Image
+
+
+# A frame ready to be sent: the downscaled image, its encoded bytes, base64 text and content digest
+ImagePayload = namedtuple("ImagePayload", ["frame_id", "image", "data", "b64", "digest"])
+
+
+def encode_image(image, size=336, quality=90, frame_id=None):
+    """
+    Downscale an image so its longest side is `size` (the vision tower input) and encode it once as JPEG.
+    The worker pads and resizes to the same resolution, so nothing the model sees is lost.
+    """
+    image = image.convert("RGB")
+    scale = size / max(image.size)
+    if scale < 1:
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(new_size, Image.BICUBIC)
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    data = buffered.getvalue()
+    return ImagePayload(frame_id, image, data, base64.b64encode(data).decode(),
+                        hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+class PayloadCache:
+    """Bounded LRU of encoded frames keyed by frame id, shared by the Generator and the Expert."""
+
+    def __init__(self, maxsize=32, size=336, quality=90):
+        self.maxsize = maxsize
+        self.size = size
+        self.quality = quality
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image, frame_id=None):
+        """Return the payload of a frame, encoding it only the first time its id is seen."""
+        if frame_id is None:
+            return encode_image(image, self.size, self.quality)
+        with self._lock:
+            payload = self._payloads.get(frame_id)
+            if payload is not None:
+                self._payloads.move_to_end(frame_id)
+                return payload
+        payload = encode_image(image, self.size, self.quality, frame_id)
+        with self._lock:
+            self._payloads[frame_id] = payload
+            self._payloads.move_to_end(frame_id)
+            while len(self._payloads) > self.maxsize:
+                self._payloads.popitem(last=False)
+        return payload
+
+    def __len__(self):
+        return len(self._payloads)
@@ -0,0 +1,41 @@
+class CommandStreamMatcher:
+    """
+    Match a command vocabulary against a streamed reply, one delta at a time.
+    A command is decided as soon as a whole word from the vocabulary has been received,
+    i.e. once the character after it arrives ('clockwise' is never read out of 'anticlockwise').
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = frozenset(word.lower() for word in vocabulary)
+        self.max_len = max(len(word) for word in self.vocabulary)
+        self.command = None
+        self._word = []
+
+    def feed(self, delta):
+        """Consume the newly streamed text; return the command once it is unambiguous, else None."""
+        if self.command is not None:
+            return self.command
+        for ch in delta:
+            if ch.isalpha():
+                # Words longer than any command cannot match, no need to keep growing them
+                if len(self._word) <= self.max_len:
+                    self._word.append(ch)
+                continue
+            if self._check_word():
+                return self.command
+        return None
+
+    def finish(self):
+        """Flush the trailing word at the end of the stream."""
+        if self.command is None:
+            self._check_word()
+        return self.command
+
+    def _check_word(self):
+        word = ''.join(self._word).lower()
+        self._word = []
+        if word in self.vocabulary:
+            self.command = word
+            return True
+        return False
+
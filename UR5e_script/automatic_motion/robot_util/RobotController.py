@@ -1,111 +1,117 @@
+import numpy as np
 from robot_util.UR_tasks import URTasks as URT
 
 class RobotController:
-    def __init__(self, ip, port):
+    # Command vocabulary of the Generator; 'anticlockwise' is listed before 'clockwise', which it contains
+    COMMANDS = ('backward', 'right', 'left', 'down', 'forward', 'anticlockwise', 'clockwise', 'done')
+    # Lowest TCP height from which a step down is still allowed (m)
+    Z_MIN = 0.12403579
+
+    def __init__(self, ip, port, servo=None):
         self.robot = URT(ip=ip, port=port)
         self.step = 0.001
         self.angle = 1
-        pass
+        # Servo mode options (e.g. {'mode': 'servo', 'gain': 300, 'lookahead_time': 0.1}); None keeps movel steps
+        self.servo = servo
 
     def go_rand_init(self):
-
-        self.robot.go_home()
-        self.robot.go_rand_init()
+        # Programs replace the servo control script, so servo mode is left for the reset and entered again
+        self.robot.stop_servo()
+        # Home and the random offset run as one program
+        self.robot.go_rand_init(from_home=True)
+        if self.servo is not None:
+            self.robot.start_servo(**self.servo)
 
 
     def interpret_instruction(self, instruction):
         """Interprets the LLM instruction and returns a robot command without executing it."""
-        commands = {
-            'backward': 'backward',
-            'right': 'right',
-            'left': 'left',
-            'down': 'down',
-            'forward': 'forward',
-            'clockwise': 'clockwise',
-            'anticlockwise': 'anticlockwise',
-            'done': 'done'
-        }
-        for command in commands.keys():
+        for command in self.COMMANDS:
             if command in instruction:
                 return command
         return None  # Return None if no known command is found
 
 
-    def reverse_x(self, move_holder):
-        forward_count = move_holder.count('forward')
-        backward_count = move_holder.count('backward')
-        if forward_count > backward_count:
-            move_holder[:] = ['backward' if x == 'forward' else x for x in move_holder]
-            correct_steps = move_holder.count('backward')
-            for _ in range(correct_steps):
-                self.robot.step_backward(self.step) 
-            print(f"Corrected X direction: converted forwards to backwards, steps corrected: {correct_steps}")
+    def _reverse_axis(self, move_holder, first, second, label):
+        """Turn the dominant direction of one axis around in the history; return the correction steps."""
+        if move_holder.count(first) > move_holder.count(second):
+            src, dst = first, second
         else:
-            move_holder[:] = ['forward' if x == 'backward' else x for x in move_holder]
-            correct_steps = move_holder.count('forward')
-            for _ in range(correct_steps):
-                self.robot.step_forward(self.step)  
-            print(f"Corrected X direction: converted backwards to forwards, steps corrected: {correct_steps}")
+            src, dst = second, first
+        move_holder[:] = [dst if x == src else x for x in move_holder]
+        correct_steps = move_holder.count(dst)
+        print(f"Corrected {label} direction: converted {src} to {dst}, steps corrected: {correct_steps}")
+        return [dst] * correct_steps
+
+    def reverse_x(self, move_holder):
+        self.execute_commands(self._reverse_axis(move_holder, 'forward', 'backward', 'X'))
 
     def reverse_y(self, move_holder):
-        left_count = move_holder.count('left')
-        right_count = move_holder.count('right')
-        if left_count > right_count:
-            move_holder[:] = ['right' if x == 'left' else x for x in move_holder]
-            correct_steps = move_holder.count('right')
-            for _ in range(correct_steps):
-                self.robot.step_right(self.step)  
-            print(f"Corrected Y direction: converted lefts to rights, steps corrected: {correct_steps}")
-        else:
-            move_holder[:] = ['left' if x == 'right' else x for x in move_holder]
-            correct_steps = move_holder.count('left')
-            for _ in range(correct_steps):
-                self.robot.step_left(self.step) 
-            print(f"Corrected Y direction: converted rights to lefts, steps corrected: {correct_steps}")
+        self.execute_commands(self._reverse_axis(move_holder, 'left', 'right', 'Y'))
 
     def reverse_clockwise(self, move_holder):
-        clockwise_count = move_holder.count('clockwise')
-        anticlockwise_count = move_holder.count('anticlockwise')
-        if clockwise_count > anticlockwise_count:
-            move_holder[:] = ['anticlockwise' if x == 'clockwise' else x for x in move_holder]
-            correct_steps = move_holder.count('anticlockwise')
-            for _ in range(correct_steps):
-                self.robot.step_anticlockwise(self.angle) 
-            print(f"Corrected RZ direction: converted clockwise to anticlockwise, steps corrected: {correct_steps}")
-        else:
-            move_holder[:] = ['clockwise' if x == 'anticlockwise' else x for x in move_holder]
-            correct_steps = move_holder.count('clockwise')
-            for _ in range(correct_steps):
-                self.robot.step_clockwise(self.angle) 
-            print(f"Corrected RZ direction: converted anticlockwise to clockwise, steps corrected: {correct_steps}")
+        self.execute_commands(self._reverse_axis(move_holder, 'clockwise', 'anticlockwise', 'RZ'))
 
-    def correct(self, eva, move_holder):
+    def plan_correction(self, eva, move_holder):
+        """Update move_holder from the Expert's verdict and return the correction steps, without moving."""
         # Sample eva: 'No, closer along x, closer along y, not closer along rz'
         parts = eva.split(', ')
         x_correct = parts[1].startswith('closer')
         y_correct = parts[2].startswith('closer')
         rz_correct = parts[3].startswith('closer')
 
+        corrections = []
         if not x_correct:
-            self.reverse_x(move_holder)
+            corrections += self._reverse_axis(move_holder, 'forward', 'backward', 'X')
         if not y_correct:
-            self.reverse_y(move_holder)
+            corrections += self._reverse_axis(move_holder, 'left', 'right', 'Y')
         if not rz_correct:
-            self.reverse_clockwise(move_holder)
+            corrections += self._reverse_axis(move_holder, 'clockwise', 'anticlockwise', 'RZ')
+        return corrections
+
+    def correct(self, eva, move_holder):
+        self.execute_commands(self.plan_correction(eva, move_holder))
+
+    def predict(self, commands, state=None):
+        """Joints and TCP pose after each command, planned from the last known state."""
+        return self.robot.predict(commands, self.step, self.angle, state)
+
+    def reachable(self, commands, state=None):
+        """Whether every pose along the commands has an IK solution."""
+        if not commands:
+            return True
+        q, _ = self.predict(commands, state)
+        return not np.isnan(q).any()
+
+    def execute_commands(self, commands, blend=None):
+        """Run a list of step commands as one motion (or one blended path), whatever its length."""
+        if not self.reachable(commands):
+            print(f"Skip {len(commands)} steps: the path leaves the workspace")
+            return
+        self.robot.run_commands(commands, self.step, self.angle, blend)
 
 
     def move_based_on_instruction(self, instruction):
-        # Define all possible movement commands including 'done'
-        current_pose = self.robot.get_tcp() 
-        z = current_pose[2] 
+        # Plan from the last streamed state: the height check and the predicted target need no query
+        state = self.robot.last_state()
+        z = state.tcp[2]
+        command = self.interpret_instruction(instruction)
+        if command not in (None, 'done') and not self.reachable([command], state):
+            print(f"Skip {command}: the target leaves the workspace")
+            return command
+        if self.robot.servo_running and command not in (None, 'done'):
+            if command == 'down' and z <= self.Z_MIN:
+                print("Skip down due to safety limits")
+            else:
+                self.robot.servo_step([command], self.step, self.angle)
+            return command
         commands = {
             'backward': lambda:  self.robot.step_back(self.step),
             'right': lambda: self.robot.step_right(self.step),
             'left': lambda: self.robot.step_left(self.step),
-            'down': lambda: self.robot.step_down(self.step) if z > 0.12403579 else print("Skip down due to safety limits"),
+            'down': lambda: self.robot.step_down(self.step) if z > self.Z_MIN else print("Skip down due to safety limits"),
             'forward': lambda: self.robot.step_forward(self.step),
-            'clockwise': lambda: self.robot.step_clockwise(self.angle),
             'anticlockwise': lambda: self.robot.step_anticlockwise(self.angle),
+            'clockwise': lambda: self.robot.step_clockwise(self.angle),
             'done': lambda: self.robot.done()  # Adding the done command
         }
         for command, action in commands.items():
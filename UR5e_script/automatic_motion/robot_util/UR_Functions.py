@@ -3,10 +3,9 @@
 import socket
 import numpy as np
 import util
-from time import sleep
-import struct
-from rtde_control import RTDEControlInterface
-from rtde_io import RTDEIOInterface
+from state_stream import RobotStateStream
+from ur_packet import PacketFramer, parse_packet
+from urscript import Program
 
 
 class URfunctions:
@@ -14,10 +13,20 @@ class URfunctions:
         self.target_ip = (ip, port)
         self.sk = socket.socket()
         print('Connected to robot')
-        self.rtde_io = RTDEIOInterface(ip)
+        self._rtde_io = None
+        # One long-lived connection streams the robot state; reads are memory lookups
+        self.state_stream = RobotStateStream(ip, port).start()
 
         self.home_joint_config = [0, -(90 / 360.0) * 2 * np.pi, 0, -(90 / 360.0) * 2 * np.pi, 0, 0.0]
 
+    @property
+    def rtde_io(self):
+        # Opened on first use: nothing in the motion path needs RTDE, and a mock controller does not serve it
+        if self._rtde_io is None:
+            from rtde_io import RTDEIOInterface
+            self._rtde_io = RTDEIOInterface(self.target_ip[0])
+        return self._rtde_io
+
     def send_script(self, script_path):
         with open(script_path, 'r') as file:
             script = file.read()
@@ -31,42 +40,95 @@ class URfunctions:
     def close_connection(self):
         self.sk.close()
 
+    def parse_tcp_state_data(self, state_data, subpackage):
+        """Decode 'joint_data' (actual joints) or 'cartesian_info' (actual TCP pose) from raw state bytes."""
+        packets = PacketFramer().feed(state_data)
+        if not packets:
+            raise ValueError("No complete realtime packet in state data")
+        data = parse_packet(packets[-1])
+        if subpackage == 'joint_data':
+            return data['q_actual'].astype(float)
+        if subpackage == 'cartesian_info':
+            return data['tool_vector_actual'].astype(float)
+        raise ValueError(f"Unknown state subpackage: {subpackage}")
+
     def get_current_joint_positions(self):
-        self.reconnect_socket()
-        state_data = self.sk.recv(1500)
-        actual_joint_positions = self.parse_tcp_state_data(state_data, 'joint_data')
-        self.close_connection()
-        return np.asarray(actual_joint_positions)
+        return self.state_stream.latest().q.astype(float)
 
     def get_current_tcp(self):
+        return self.state_stream.latest().tcp.astype(float)
+
+    def send_program(self, program):
+        """Send a compiled program on a fresh connection; the controller starts it right away."""
         self.reconnect_socket()
-        state_data = self.sk.recv(1500)
-        actual_tool_positions = self.parse_tcp_state_data(state_data, 'cartesian_info')
+        self.sk.sendall(program.script().encode('utf-8'))
         self.close_connection()
-        return np.asarray(actual_tool_positions)
 
-    def move_joint_list(self, q, v = 0.5, a = 0.2, r = 0.05):
+    def run_program(self, program, wait=True, timeout=None, stall_time=1.0):
+        """
+        Send a whole Program at once and track completion for the program, not for each move:
+        the waiter watches for the robot at rest on the program's final target.
+        :param timeout: seconds before the completion fails, default 10 s per command
+        :return: the final state, or with wait=False a Future of it; None if the program
+            ends with a speed command and has no target to wait for
+        """
+        timeout = timeout if timeout is not None else 10.0 * len(program)
+        target = program.final_target()
+        completion = None
+        if target is not None:
+            kind, value = target
+            # A 1 mm step is inside the position tolerance, and a multi-move program may end where it
+            # starts: only a stop after moving counts, unless the arm already stands on the target
+            require_motion = len(program) > 1 or not self.at_target(kind, value)
+            options = dict(timeout=timeout, stall_time=stall_time, wait=False, require_motion=require_motion)
+            if kind == 'joints':
+                completion = self.wait_for_target_joints(value, **options)
+            else:
+                completion = self.wait_for_target_position(value, **options)
+        # The waiter is registered before sending, so a fast program cannot finish unseen
+        self.send_program(program)
+        if completion is None or not wait:
+            return completion
+        return completion.result(timeout + 1.0)
+
+    def at_target(self, kind, value, tol=1e-4, angle_tol=1e-3):
+        """
+        Whether the arm already stands on a target ('joints' or 'pose'), within tolerances far below
+        a step, so a program to it will not move the arm at all.
+        """
+        state = self.state_stream.latest()
+        value = np.asarray(value, dtype=float)
+        if kind == 'joints':
+            return bool(np.all(np.abs(state.q - value) < angle_tol))
+        if not np.all(np.abs(state.tcp[:3] - value[:3]) < tol):
+            return False
+        rotation = util.rm2rv(util.rv2rm(*value[3:]) @ util.rv2rm(*state.tcp[3:]).T)
+        return bool(np.linalg.norm(rotation) < angle_tol)
+
+    def move_joint_list(self, q, v = 0.5, a = 0.2, r = 0.05, wait=True, timeout=10.0):
         """
         move the arm according joint state
         :param q: joint state list
         :param v: vel
         :param a: acc
         :param r: blend radius
+        :param wait: block until the move completes; otherwise return a Future of the completion
+        :param timeout: seconds before the completion fails with TimeoutError
         """
-        self.reconnect_socket()
-        joint_positions = ','.join([f"{pos}" for pos in q])
-        tcp_command = f"def process():\n"
-        tcp_command += f"  movej([{joint_positions}], a={a}, v={v}, a={r})\n"
-        tcp_command += "end\n"
-        self.sk.send(str.encode(tcp_command))
-        self.wait_for_target_joints(q)
-        self.close_connection()
+        return self.run_program(Program('process').movej(q, a=a, v=v, r=r), wait=wait, timeout=timeout)
 
-    def wait_for_target_joints(self, target_joints, tol=0.01):
-        actual_joints = self.get_current_joint_positions()
-        while not all(np.abs(actual_joints - np.array(target_joints)) < tol):
-            sleep(0.1)
-            actual_joints = self.get_current_joint_positions()
+    def wait_for_target_joints(self, target_joints, tol=0.01, vel_tol=0.005, timeout=10.0, stall_time=1.0,
+                               wait=True, require_motion=False):
+        """
+        Wait, on the streamed state, until every joint is within tol of the target and at rest.
+        With wait=False return a Future instead (await it with asyncio.wrap_future).
+        """
+        target_joints = np.asarray(target_joints, dtype=float)
+        completion = self.state_stream.wait_for(
+            reached=lambda state: np.all(np.abs(state.q - target_joints) < tol),
+            moving=lambda state: np.any(np.abs(state.qd) > vel_tol),
+            timeout=timeout, stall_time=stall_time, label='movej', require_motion=require_motion)
+        return completion.result(timeout + 1.0) if wait else completion
 
     def move_joint_enum(self, q1, q2, q3, q4, q5, q6, a, v):
         """
@@ -75,27 +137,7 @@ class URfunctions:
         :param a: acc
         :param v: vel
         """
-        self.reconnect_socket()
-        data = "def test():\n movej(["
-        data += str(q1)
-        data += ","
-        data += str(q2)
-        data += ","
-        data += str(q3)
-        data += ","
-        data += str(q4)
-        data += ","
-        data += str(q5)
-        data += ","
-        data += str(q6)
-        data += "],a="
-        data += str(a)
-        data += ",v="
-        data += str(v)
-        data += ")\nend\n"
-        print(data)
-        self.sk.send(data.encode('utf-8'))
-
+        return self.move_joint_list([q1, q2, q3, q4, q5, q6], v=v, a=a, r=0, wait=False)
 
     def speedj_list(self, qd, a, t):
         """
@@ -104,18 +146,7 @@ class URfunctions:
         :param a: acc
         :param t: duration time
         """
-        data = "def test():\n speedj(["
-        for i in range(len(qd) - 1):
-            data += str(qd[i])
-            data += ","
-        data += str(qd[5])
-        data += "],a="
-        data += str(a)
-        data += ",t="
-        data += str(t)
-        data += ")\nend\n"
-        self.sk.send(data.encode('utf-8'))
-
+        self.send_program(Program('test').speedj(qd, a=a, t=t))
 
     def speedj_enum(self, qd1, qd2, qd3, qd4, qd5, qd6, a, t):
         """
@@ -124,66 +155,55 @@ class URfunctions:
         :param a: acc
         :param t: duration time
         """
-        data = "def test():\n speedj(["
-        data += str(qd1)
-        data += ","
-        data += str(qd2)
-        data += ","
-        data += str(qd3)
-        data += ","
-        data += str(qd4)
-        data += ","
-        data += str(qd5)
-        data += ","
-        data += str(qd6)
-        data += "],a="
-        data += str(a)
-        data += ",t="
-        data += str(t)
-        data += ")\nend\n"
-        print(data)
-        self.sk.send(data.encode('utf-8'))
-
-
-    def movel_tcp(self, target_tcp, vel = 0.5, acc = 0.2):
-        self.reconnect_socket()
-        tool_acc = acc  # Safe: 0.5
-        tool_vel = vel  # Safe: 0.2
-        tcp_command = "movel(p[%f,%f,%f,%f,%f,%f],a=%f,v=%f,t=0,r=0)\n" % (
-            target_tcp[0], target_tcp[1], target_tcp[2], target_tcp[3], target_tcp[4],
-            target_tcp[5], tool_acc, tool_vel)
-        self.sk.send(str.encode(tcp_command))
-        self.wait_for_target_position(target_tcp)
-        self.close_connection()
+        self.speedj_list([qd1, qd2, qd3, qd4, qd5, qd6], a, t)
 
-    def movej_tcp(self, target_tcp, vel, acc):
-        self.reconnect_socket()
-        tool_acc = acc  # Safe: 0.5
-        tool_vel = vel  # Safe: 0.2
-        tcp_command = "movej(p[%f,%f,%f,%f,%f,%f],a=%f,v=%f,t=0,r=0)\n" % (
-            target_tcp[0], target_tcp[1], target_tcp[2], target_tcp[3], target_tcp[4],
-            target_tcp[5], tool_acc, tool_vel)
-        self.sk.send(str.encode(tcp_command))
-        self.wait_for_target_position(target_tcp)
+    def movel_tcp(self, target_tcp, vel = 0.5, acc = 0.2, wait=True, timeout=10.0):
+        # Safe: acc 0.5, vel 0.2
+        return self.run_program(Program('move').movel(target_tcp, a=acc, v=vel), wait=wait, timeout=timeout)
 
-        self.close_connection()
+    def movej_tcp(self, target_tcp, vel, acc, wait=True, timeout=10.0):
+        # Safe: acc 0.5, vel 0.2
+        return self.run_program(Program('move').movej_pose(target_tcp, a=acc, v=vel), wait=wait, timeout=timeout)
+
+    def movel_path(self, waypoints, vel = 0.5, acc = 0.2, blend = 0.001, wait=True, timeout=20.0):
+        """
+        Run several movel waypoints as one program, blending through all but the last one.
+        :param blend: blend radius in m, kept below half the shortest segment
+        """
+        program = Program('path')
+        for target_tcp in waypoints:
+            program.movel(target_tcp, a=acc, v=vel, r=blend)
+        return self.run_program(program, wait=wait, timeout=timeout)
 
-    def wait_for_target_position(self, target_tcp, tol=[0.001, 0.001, 0.001, 0.05, 0.05, 0.05]):
-        actual_tcp = self.get_current_tcp()
+    def wait_for_target_position(self, target_tcp, tol=[0.001, 0.001, 0.001, 0.05, 0.05, 0.05], vel_tol=0.002,
+                                 timeout=10.0, stall_time=1.0, wait=True, require_motion=False):
+        """
+        Wait, on the streamed state, until the TCP is within tol of the target and at rest.
+        The target orientation is converted to rpy once per call; angle differences are wrapped,
+        so a tool pointing straight down (roll near +-pi) still converges.
+        With wait=False return a Future instead (await it with asyncio.wrap_future).
+        """
+        target_tcp = np.asarray(target_tcp, dtype=float)
         target_rpy = util.rv2rpy(target_tcp[3], target_tcp[4], target_tcp[5])
-        actual_rpy = util.rv2rpy(actual_tcp[3], actual_tcp[4], actual_tcp[5])
+        tol = np.asarray(tol)
 
-        while not (all(np.abs(actual_tcp[:3] - target_tcp[:3]) < tol[:3]) and
-                   all(np.abs(actual_rpy - target_rpy) < tol[3:])):
-            sleep(0.1)
-            actual_tcp = self.get_current_tcp()
-            actual_rpy = util.rv2rpy(actual_tcp[3], actual_tcp[4], actual_tcp[5])
+        def reached(state):
+            if not np.all(np.abs(state.tcp[:3] - target_tcp[:3]) < tol[:3]):
+                return False
+            actual_rpy = util.rv2rpy(state.tcp[3], state.tcp[4], state.tcp[5])
+            diff = (actual_rpy - target_rpy + np.pi) % (2 * np.pi) - np.pi
+            return np.all(np.abs(diff) < tol[3:])
+
+        completion = self.state_stream.wait_for(
+            reached=reached,
+            moving=lambda state: np.any(np.abs(state.tcp_speed) > vel_tol),
+            timeout=timeout, stall_time=stall_time, label='movel', require_motion=require_motion)
+        return completion.result(timeout + 1.0) if wait else completion
 
     def relative_move(self, delta_x, delta_y, delta_z, delta_theta_x, delta_theta_y, delta_theta_z, vel, acc):
         """
         Move the end effector relative to its current position and orientation.
         """
-        self.reconnect_socket()
         current_tcp = self.get_current_tcp()
         rpy = util.rv2rpy(current_tcp[3], current_tcp[4], current_tcp[5])
         rpy[0] += delta_theta_x  # Adjust roll (rotation around x-axis)
@@ -197,11 +217,6 @@ class URfunctions:
             target_rv[0], target_rv[1], target_rv[2]
         ])
         self.movel_tcp(target_tcp,vel, acc)
-        self.close_connection()
 
     def get_state(self):
-        self.reconnect_socket()
-        state_data = self.sk.recv(1500)
-        self.close_connection()
-        return state_data
-        
+        return self.state_stream.latest().packet
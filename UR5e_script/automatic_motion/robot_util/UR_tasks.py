@@ -1,13 +1,22 @@
 # ur_tasks.py
 from UR_Functions import URfunctions as URControl
+from urscript import Program
+from servo import ServoMotion
+import motion_compiler
 import logging
 import math
 import random
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class URTasks:
+    HOME_JOINTS = [0.00000744, -1.57083954, 1.57082969, -1.57077511, -1.57079918, -0.00003463]
+    # TCP pose just above the hole; random starts are offset from here
+    ABOVE_HOLE = [-0.56758035, -0.03142121, 0.12421664, -2.21667038, -2.22297235, -0.00275497]
+
     def __init__(self, ip, port):
         self.robot = URControl(ip=ip, port=port)
+        # Created by start_servo; while it runs, steps move its target instead of sending programs
+        self.servo = None
 
     def initialize_robot(self):
         """Initializes robot connection and prepares it for operations."""
@@ -28,25 +37,65 @@ class URTasks:
         # print(tcp)
         return tcp
 
+    def start_servo(self, **options):
+        """Enter continuous servo mode; options go to ServoMotion the first time (mode, gain, lookahead_time, ...)."""
+        if self.servo is None:
+            self.servo = ServoMotion(self.robot, **options)
+        return self.servo.start()
+
+    def stop_servo(self):
+        """Leave servo mode, needed before any URScript program is sent."""
+        if self.servo is not None:
+            self.servo.stop()
+
+    @property
+    def servo_running(self):
+        return self.servo is not None and self.servo.running
+
+    def servo_step(self, commands, length, angle, wait=True):
+        """Offset the servo target by the net motion of the commands."""
+        delta = motion_compiler.compile_commands(commands, length, angle)
+        if motion_compiler.is_zero(delta):
+            return
+        logging.info(f"Servo step: {delta}")
+        return self.servo.move_by(delta, wait=wait)
+
+    def last_state(self):
+        """Joints and TCP pose from the newest streamed packet, read together."""
+        return self.robot.state_stream.latest()
+
+    def predict(self, commands, length, angle, state=None):
+        """Joints and TCP pose after each command, from the last known state; the robot is not queried."""
+        state = state or self.last_state()
+        return motion_compiler.predict_path(state.q, state.tcp, commands, length, angle)
+
     '''
     robot manipulation taks
     '''
 
     ###
-    def go_rand_init(self):
-        tcp = self.above_hole_circle
-        # [-0.56758035, -0.03142121, 0.12421664, -2.21667038, -2.22297235, -0.00275497]
-        x_offset = random.randint(-5, 5)  # Random int between -40 and 40
+    def rand_init_pose(self):
+        """The pose above the hole shifted by a random offset of a few mm."""
+        x_offset = random.randint(-5, 5)  # mm
         y_offset = random.randint(-5, 0)
-        z_offset = random.randint(0, 5)    # Random int between 0 and 40
-        x_offset = x_offset/1000
-        y_offset = y_offset/1000
-        z_offset = z_offset/1000
-        
-        tcp[0] += x_offset
-        tcp[1] += y_offset
-        tcp[2] += z_offset
-        self.robot.movel_tcp(tcp, 1.2, 0.25)
+        z_offset = random.randint(0, 5)
+        tcp = list(self.ABOVE_HOLE)
+        tcp[0] += x_offset / 1000
+        tcp[1] += y_offset / 1000
+        tcp[2] += z_offset / 1000
+        return tcp
+
+    def go_rand_init(self, from_home=False):
+        """
+        Move to a random start above the hole. With from_home the home move is blended into it
+        and both run as one program with one completion wait.
+        """
+        program = Program('rand_init')
+        if from_home:
+            program.movej(self.HOME_JOINTS, a=1.05, v=1.4, r=0.02)
+        program.movel(self.rand_init_pose(), a=0.25, v=1.2)
+        logging.info("Moving to a random start...")
+        self.robot.run_program(program)
 
     def rand_roat(self):
         angle = random.randint(-15, 15)
@@ -57,6 +106,10 @@ class URTasks:
         self.robot.move_joint_list(js, 1.4, 1.05, 0.02)
 
     def done(self):
+        if self.servo_running:
+            logging.info("Inserting...")
+            self.servo.move_by(motion_compiler.MotionDelta(0.0, 0.0, -0.005, 0.0))
+            return
         tcp = self.get_tcp()
         tcp[2] -= 0.005 # m
         logging.info("Inserting...")
@@ -112,10 +165,28 @@ class URTasks:
         logging.info("Moving anticlockwise...")
         self.robot.move_joint_list(js, 1.4, 1.05, 0.02)
   
+    def run_commands(self, commands, length, angle, blend=None):
+        """
+        Run a list of step commands as a single motion to their net pose,
+        or, with a blend radius, as one blended path through every change of direction.
+        """
+        if self.servo_running:
+            self.servo_step(commands, length, angle)
+            return
+        delta = motion_compiler.compile_commands(commands, length, angle)
+        if motion_compiler.is_zero(delta):
+            return
+        tcp = self.get_tcp()
+        logging.info(f"Moving {len(commands)} steps at once: {delta}")
+        if blend is None:
+            self.robot.movel_tcp(motion_compiler.apply_delta(tcp, delta), 0.5, 0.2)
+        else:
+            waypoints = motion_compiler.compile_path(tcp, commands, length, angle)
+            self.robot.movel_path(waypoints, 0.5, 0.2, blend)
+
     def go_home(self):
-        joint_state = [0.00000744, -1.57083954, 1.57082969, -1.57077511, -1.57079918, -0.00003463]
         logging.info("Moving to home position...")
-        self.robot.move_joint_list(joint_state, 1.4, 1.05, 0.02)
+        self.robot.move_joint_list(self.HOME_JOINTS, 1.4, 1.05, 0.02)
 
     def move_up(self, length):
         tcp = self.get_tcp()
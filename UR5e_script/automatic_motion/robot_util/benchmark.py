@@ -0,0 +1,208 @@
+# benchmark.py
+# Micro-benchmarks for the robot layer; run from robot_util: python benchmark.py [name ...]
+# The state_read, motion_completion and step_latency benchmarks run against mock_robot on localhost.
+import contextlib
+import io
+import os
+import struct
+import sys
+import time
+import numpy as np
+from ur_packet import RT_FIELDS, RT_STATE_DTYPE, PacketFramer, decode_motion, parse_packet
+import kinematics
+import util
+from mock_robot import MockURController
+from UR_Functions import URfunctions
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def make_packet(rng=None):
+    """A realtime packet of the newest layout filled with random values."""
+    rng = rng or np.random.default_rng(0)
+    record = np.zeros(1, dtype=RT_STATE_DTYPE)
+    for name in RT_STATE_DTYPE.names[1:]:
+        record[name] = rng.standard_normal(record[name].shape)
+    record['message_size'] = RT_STATE_DTYPE.itemsize
+    # The framer checks the controller time for plausibility
+    record['time'] = 1234.5
+    return record.tobytes()
+
+
+def bench_packet_parse(repeat=20000):
+    """
+    Packet decoding on the same field set for every method: all fields (structured dtype against
+    struct.unpack per field), and the five the state stream reads (adding ur_packet.decode_motion).
+    """
+    packet = make_packet()
+    layout, offset = [], 0
+    for name, dtype, count in RT_FIELDS:
+        fmt = '>i' if dtype == '>i4' else f'>{count}d'
+        layout.append((name, struct.Struct(fmt), offset))
+        offset += struct.calcsize(fmt)
+    state_fields = ('time', 'q_actual', 'qd_actual', 'tool_vector_actual', 'tcp_speed_actual')
+    state_layout = [field for field in layout if field[0] in state_fields]
+
+    def struct_fields(fields):
+        return lambda: {name: fmt.unpack_from(packet, off) for name, fmt, off in fields}
+
+    def numpy_fields(names):
+        def parse():
+            data = parse_packet(packet)
+            return {name: data[name] for name in names}
+        return parse
+
+    parsed, unpacked = parse_packet(packet), struct_fields(layout)()
+    assert all(np.allclose(parsed[name], unpacked[name]) for name, _, _ in layout)
+    motion = decode_motion(packet)
+    assert all(np.allclose(parsed[name], value) for name, value in zip(state_fields, motion))
+
+    all_names = [name for name, _, _ in layout]
+    t_struct = timeit(struct_fields(layout), repeat)
+    t_numpy = timeit(numpy_fields(all_names), repeat)
+    print(f"packet parse, all {len(layout)} fields ({len(packet)} bytes): "
+          f"struct.unpack_from {t_struct * 1e6:.2f} us, structured dtype {t_numpy * 1e6:.2f} us")
+    t_struct = timeit(struct_fields(state_layout), repeat)
+    t_numpy = timeit(numpy_fields(state_fields), repeat)
+    t_motion = timeit(lambda: decode_motion(packet), repeat)
+    print(f"packet parse, {len(state_fields)} state fields: struct.unpack_from {t_struct * 1e6:.2f} us (tuples), "
+          f"structured dtype {t_numpy * 1e6:.2f} us, decode_motion {t_motion * 1e6:.2f} us")
+
+    # Framing: the stream arrives in arbitrary chunks
+    stream = packet * 100
+    chunks = [stream[i:i + 1500] for i in range(0, len(stream), 1500)]
+
+    def frame():
+        framer = PacketFramer()
+        return [p for chunk in chunks for p in framer.feed(chunk)]
+
+    assert len(frame()) == 100
+    t_frame = timeit(frame, max(1, repeat // 100)) / 100
+    print(f"packet framing: {t_frame * 1e6:.2f} us per packet")
+
+
+def bench_pose_conversion(n=5000, repeat=5):
+    """rv <-> rpy over a whole trajectory: one call per pose against one batched call."""
+    rng = np.random.default_rng(0)
+    rv = rng.uniform(-1.5, 1.5, (n, 3))
+
+    def per_pose():
+        return np.array([util.rpy2rv(util.rv2rpy(*v)) for v in rv])
+
+    def batched():
+        return util.rpy2rv_batch(util.rv2rpy_batch(rv))
+
+    assert np.array_equal(per_pose(), batched())
+    t_loop = timeit(per_pose, repeat)
+    t_batch = timeit(batched, repeat)
+    print(f"pose conversion ({n} poses, rv -> rpy -> rv): per pose {t_loop * 1e3:.2f} ms, "
+          f"batched {t_batch * 1e3:.2f} ms, speedup {t_loop / t_batch:.1f}x")
+
+
+def bench_kinematics(n=2000, repeat=5):
+    """Batched FK and IK against one pose at a time, with an FK round-trip check."""
+    rng = np.random.default_rng(0)
+    q = rng.uniform(-np.pi, np.pi, (n, 6))
+    pose = kinematics.fk_pose(q)
+    q_ik = kinematics.ik_nearest(pose, q)
+    assert np.allclose(q_ik, q, atol=1e-8)
+
+    t_fk = timeit(lambda: kinematics.fk_pose(q), repeat)
+    t_ik = timeit(lambda: kinematics.ik_nearest(pose, q), repeat)
+    t_fk1 = timeit(lambda: kinematics.fk_pose(q[0]), repeat * 100)
+    t_ik1 = timeit(lambda: kinematics.ik_nearest(pose[0], q[0]), repeat * 100)
+    print(f"kinematics ({n} poses): fk {t_fk / n * 1e6:.2f} us/pose batched, {t_fk1 * 1e6:.2f} us single; "
+          f"ik {t_ik / n * 1e6:.2f} us/pose batched, {t_ik1 * 1e6:.2f} us single")
+
+
+def _stats(samples):
+    if not len(samples):
+        return "no samples"
+    samples = np.asarray(samples) * 1e3
+    return f"mean {samples.mean():.2f} ms, p95 {np.percentile(samples, 95):.2f} ms, max {samples.max():.2f} ms"
+
+
+def bench_state_read(reads=100000, duration=1.0):
+    """Reads of the latest TCP pose per second, and how old the state they return is when sampled at 1 kHz."""
+    for frequency in (125, 500):
+        with MockURController(port=0, frequency=frequency) as mock:
+            robot = URfunctions('127.0.0.1', mock.port)
+            robot.get_current_tcp()
+            t_read = timeit(robot.get_current_tcp, reads)
+
+            ages, packets = [], set()
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                state = robot.state_stream.latest()
+                ages.append(time.time() - state.received)
+                packets.add(state.timestamp)
+                time.sleep(0.001)
+            robot.state_stream.stop()
+        print(f"state read at {frequency} Hz: {1 / t_read:.0f} reads/s, {len(packets) / duration:.0f} packets/s seen, "
+              f"state age {_stats(ages)}")
+
+
+def bench_motion_completion(moves=20, speed=1.0, step=0.001, noise=2e-5):
+    """
+    Time from the simulated arm coming to rest to movel_tcp returning, on the loop's 1 mm steps with
+    sensor noise; a call that returns before the arm reached the target is counted as early.
+    """
+    for frequency in (125, 500):
+        with MockURController(port=0, frequency=frequency, speed=speed, noise=noise) as mock:
+            robot = URfunctions('127.0.0.1', mock.port)
+            latencies, totals, early = [], [], 0
+            for i in range(moves):
+                tcp = robot.get_current_tcp()
+                tcp[1] += step if i % 2 else -step
+                start = time.time()
+                robot.movel_tcp(tcp, 0.5, 0.2)
+                done = time.time()
+                if mock.busy or np.linalg.norm(mock.tcp[:3] - tcp[:3]) > step / 2:
+                    early += 1
+                    continue
+                totals.append(done - start)
+                latencies.append(done - mock.finished_at)
+            robot.state_stream.stop()
+        print(f"motion completion at {frequency} Hz: {early}/{moves} early; "
+              f"detection {_stats(latencies)}; whole move {_stats(totals)}")
+
+
+def bench_step_latency(steps=20, speed=1.0, noise=2e-5):
+    """Wall time per RobotController step, the call the interaction loop makes for every Generator command."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from robot_util.RobotController import RobotController
+    for frequency in (125, 500):
+        with MockURController(port=0, frequency=frequency, speed=speed, noise=noise) as mock:
+            controller = RobotController('127.0.0.1', mock.port)
+            durations = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                early = 0
+                for i in range(steps):
+                    start = time.time()
+                    controller.move_based_on_instruction('left' if i % 2 else 'right')
+                    durations.append(time.time() - start)
+                    # A step must not return while the arm is still on its way
+                    early += mock.busy
+            # One step of 1 mm at 0.2 m/s takes 5 ms of motion; the rest is overhead
+            controller.robot.robot.state_stream.stop()
+        print(f"step latency at {frequency} Hz: {early}/{steps} early; {_stats(durations)}")
+
+
+BENCHMARKS = {
+    'packet_parse': bench_packet_parse,
+    'pose_conversion': bench_pose_conversion,
+    'kinematics': bench_kinematics,
+    'state_read': bench_state_read,
+    'motion_completion': bench_motion_completion,
+    'step_latency': bench_step_latency,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,179 @@
+# kinematics.py
+# UR5e forward and analytic inverse kinematics from the DH parameters, on batches of poses.
+# Poses are UR pose vectors [x, y, z, rx, ry, rz] in the base frame, as the controller reports them.
+import numpy as np
+import util
+
+# UR5e DH parameters (m, rad)
+D = np.array([0.1625, 0.0, 0.0, 0.1333, 0.0997, 0.0996])
+A = np.array([0.0, -0.425, -0.3922, 0.0, 0.0, 0.0])
+ALPHA = np.array([np.pi / 2, 0.0, 0.0, np.pi / 2, -np.pi / 2, 0.0])
+
+# Farthest the flange reaches from the shoulder axis, ignoring the wrist links
+REACH = abs(A[1]) + abs(A[2]) + D[4] + D[5]
+
+
+def dh(theta, i):
+    """Transform of link i for joint angles theta of any shape; returns (..., 4, 4)."""
+    theta = np.asarray(theta, dtype=float)
+    ct, st = np.cos(theta), np.sin(theta)
+    ca, sa = np.cos(ALPHA[i]), np.sin(ALPHA[i])
+    T = np.zeros(theta.shape + (4, 4))
+    T[..., 0, 0] = ct
+    T[..., 0, 1] = -st * ca
+    T[..., 0, 2] = st * sa
+    T[..., 0, 3] = A[i] * ct
+    T[..., 1, 0] = st
+    T[..., 1, 1] = ct * ca
+    T[..., 1, 2] = -ct * sa
+    T[..., 1, 3] = A[i] * st
+    T[..., 2, 1] = sa
+    T[..., 2, 2] = ca
+    T[..., 2, 3] = D[i]
+    T[..., 3, 3] = 1.0
+    return T
+
+
+def inv(T):
+    """Inverse of rigid transforms (..., 4, 4)."""
+    R = np.swapaxes(T[..., :3, :3], -1, -2)
+    Ti = np.zeros_like(T)
+    Ti[..., :3, :3] = R
+    Ti[..., :3, 3] = -(R @ T[..., :3, 3, None])[..., 0]
+    Ti[..., 3, 3] = 1.0
+    return Ti
+
+
+def pose_to_matrix(pose):
+    """(N, 6) pose vectors to (N, 4, 4) transforms."""
+    pose = np.asarray(pose, dtype=float).reshape(-1, 6)
+    T = np.zeros((len(pose), 4, 4))
+    T[:, :3, :3] = util.rv2rm_batch(pose[:, 3:])
+    T[:, :3, 3] = pose[:, :3]
+    T[:, 3, 3] = 1.0
+    return T
+
+
+def matrix_to_pose(T):
+    """(N, 4, 4) transforms to (N, 6) pose vectors."""
+    T = np.asarray(T, dtype=float).reshape(-1, 4, 4)
+    return np.concatenate([T[:, :3, 3], util.rm2rv_batch(T[:, :3, :3])], axis=-1)
+
+
+def fk(q, tool=None):
+    """
+    Flange transform (or TCP transform, given the tool offset as a 4x4 or a pose vector)
+    for joint angles q of shape (6,) or (N, 6).
+    """
+    q = np.asarray(q, dtype=float)
+    single = q.ndim == 1
+    q = q.reshape(-1, 6)
+    T = dh(q[:, 0], 0)
+    for i in range(1, 6):
+        T = T @ dh(q[:, i], i)
+    if tool is not None:
+        T = T @ _as_matrix(tool)
+    return T[0] if single else T
+
+
+def fk_pose(q, tool=None):
+    """Pose vectors [x, y, z, rx, ry, rz] for joint angles of shape (6,) or (N, 6)."""
+    q = np.asarray(q, dtype=float)
+    pose = matrix_to_pose(fk(q.reshape(-1, 6), tool))
+    return pose[0] if q.ndim == 1 else pose
+
+
+def tool_offset(q, tcp):
+    """The TCP offset as a 4x4 transform, from one state sample of joints and reported TCP pose."""
+    return inv(fk(q)) @ pose_to_matrix(tcp)[0]
+
+
+def _as_matrix(tool):
+    tool = np.asarray(tool, dtype=float)
+    return tool if tool.shape[-2:] == (4, 4) else pose_to_matrix(tool)[0]
+
+
+def ik(T, q6_default=0.0, eps=1e-6):
+    """
+    All analytic solutions for flange transforms T of shape (N, 4, 4).
+    Returns (N, 8, 6) joint angles in (-pi, pi]; unreachable branches are NaN.
+    At the wrist singularity (sin q5 = 0) q6 is not determined and q6_default is used.
+    """
+    T = np.asarray(T, dtype=float).reshape(-1, 4, 4)
+    n = len(T)
+    q6_default = np.broadcast_to(np.asarray(q6_default, dtype=float), (n,))[:, None]
+    # Branches: shoulder left/right, wrist up/down, elbow up/down
+    shoulder = np.array([1, 1, 1, 1, -1, -1, -1, -1])
+    wrist = np.array([1, 1, -1, -1, 1, 1, -1, -1])
+    elbow = np.array([1, -1, 1, -1, 1, -1, 1, -1])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # q1: wrist center p05 lies d6 behind the flange along its z axis
+        p05 = T[:, :3, 3] - D[5] * T[:, :3, 2]
+        r = np.hypot(p05[:, 0], p05[:, 1])
+        phi = np.arctan2(p05[:, 1], p05[:, 0])
+        psi = np.arccos(D[3] / r)
+        q1 = phi[:, None] + shoulder * psi[:, None] + np.pi / 2
+
+        # q5
+        s1, c1 = np.sin(q1), np.cos(q1)
+        p06 = T[:, None, :3, 3]
+        c5 = (p06[..., 0] * s1 - p06[..., 1] * c1 - D[3]) / D[5]
+        q5 = wrist * np.arccos(np.clip(c5, -1.0, 1.0))
+        q5 = np.where(np.abs(c5) > 1 + 1e-9, np.nan, q5)
+
+        # q6: z1 . x6 = s5 c6, z1 . y6 = -s5 s6
+        s5 = np.sin(q5)
+        X, Y = T[:, None, :3, 0], T[:, None, :3, 1]
+        q6 = np.arctan2((-Y[..., 0] * s1 + Y[..., 1] * c1) / s5, (X[..., 0] * s1 - X[..., 1] * c1) / s5)
+        # 奇异位置: q6 不唯一
+        q6 = np.where(np.abs(s5) < eps, q6_default, q6)
+
+        # q2, q3: joints 2-4 move the wrist in the x-y plane of frame 1
+        T06 = np.broadcast_to(T[:, None], (n, 8, 4, 4))
+        T14 = inv(dh(q1, 0)) @ T06 @ inv(dh(q5, 4) @ dh(q6, 5))
+        px, py = T14[..., 0, 3], T14[..., 1, 3]
+        c3 = (px * px + py * py - A[1] ** 2 - A[2] ** 2) / (2 * A[1] * A[2])
+        q3 = elbow * np.arccos(np.clip(c3, -1.0, 1.0))
+        q3 = np.where(np.abs(c3) > 1 + 1e-9, np.nan, q3)
+        q2 = np.arctan2(py, px) - np.arctan2(A[2] * np.sin(q3), A[1] + A[2] * np.cos(q3))
+
+        T13 = dh(q2, 1) @ dh(q3, 2)
+        T34 = inv(T13) @ T14
+        q4 = np.arctan2(T34[..., 1, 0], T34[..., 0, 0])
+
+    q = np.stack([q1, q2, q3, q4, q5, q6], axis=-1)
+    q = (q + np.pi) % (2 * np.pi) - np.pi
+    q[np.isnan(q).any(axis=-1)] = np.nan
+    return q
+
+
+def ik_nearest(pose, q_ref, tool=None):
+    """
+    The IK solution closest to q_ref for each pose, with each joint unwrapped to within pi of q_ref,
+    so the result is what a movej from q_ref would command. pose is (6,) or (N, 6), q_ref (6,) or (N, 6).
+    Unreachable poses give a row of NaN.
+    """
+    pose = np.asarray(pose, dtype=float)
+    single = pose.ndim == 1
+    T = pose_to_matrix(pose)
+    if tool is not None:
+        T = T @ inv(_as_matrix(tool))
+    q_ref = np.broadcast_to(np.asarray(q_ref, dtype=float), (len(T), 6))
+    sols = ik(T, q6_default=q_ref[:, 5])
+    # Unwrap every joint to the nearest turn of the reference
+    sols = q_ref[:, None] + (sols - q_ref[:, None] + np.pi) % (2 * np.pi) - np.pi
+    dist = np.sum((sols - q_ref[:, None]) ** 2, axis=-1)
+    dist = np.where(np.isnan(dist), np.inf, dist)
+    best = sols[np.arange(len(T)), np.argmin(dist, axis=1)]
+    return best[0] if single else best
+
+
+def reachable(pose, tool=None):
+    """Whether each pose has at least one IK solution."""
+    pose = np.asarray(pose, dtype=float)
+    T = pose_to_matrix(pose)
+    if tool is not None:
+        T = T @ inv(_as_matrix(tool))
+    ok = ~np.isnan(ik(T)).all(axis=(1, 2))
+    return ok[0] if pose.ndim == 1 else ok
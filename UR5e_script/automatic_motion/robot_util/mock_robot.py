@@ -0,0 +1,349 @@
+# mock_robot.py
+# A local stand-in for the UR controller's realtime interface, for running the robot layer without the arm:
+#   python mock_robot.py [--port 30003] [--hz 125] [--speed 1.0] [--noise 0.0]
+# It streams realtime packets on every connection and executes the URScript motion commands it receives.
+import argparse
+import logging
+import re
+import socket
+import threading
+import time
+from collections import deque
+import numpy as np
+import kinematics
+import util
+from ur_packet import state_dtype
+from urscript import MoveJ, MoveJPose, MoveL, ServoJ, SpeedJ, Sleep
+
+HOME_JOINTS = [0.0, -np.pi / 2, np.pi / 2, -np.pi / 2, -np.pi / 2, 0.0]
+
+_CALL = re.compile(r"^\s*(movej|movel|servoj|speedj|sleep)\s*\((.*)\)\s*$")
+_VECTOR = re.compile(r"^(p?)\[([^\]]*)\]\s*,?\s*(.*)$")
+_KWARG = re.compile(r"(\w+)\s*=\s*([-+0-9.eE]+)")
+
+
+def parse_script(text):
+    """
+    The motion commands of a URScript program (or of bare script lines), as urscript commands.
+    Lines other than movej/movel/servoj/speedj/sleep calls are ignored.
+    """
+    commands = []
+    for line in text.splitlines():
+        match = _CALL.match(line)
+        if not match:
+            continue
+        name, args = match.groups()
+        if name == 'sleep':
+            commands.append(Sleep(float(args)))
+            continue
+        vector = _VECTOR.match(args.strip())
+        if not vector:
+            raise ValueError(f"Cannot parse URScript line: {line.strip()}")
+        is_pose, values, rest = vector.groups()
+        values = tuple(float(v) for v in values.split(','))
+        kwargs = {key: float(value) for key, value in _KWARG.findall(rest)}
+        if name == 'movej':
+            command = MoveJPose if is_pose else MoveJ
+            commands.append(command(values, kwargs.get('a', 1.4), kwargs.get('v', 1.05),
+                                    kwargs.get('t', 0.0), kwargs.get('r', 0.0)))
+        elif name == 'movel':
+            commands.append(MoveL(values, kwargs.get('a', 1.2), kwargs.get('v', 0.25),
+                                  kwargs.get('t', 0.0), kwargs.get('r', 0.0)))
+        elif name == 'servoj':
+            commands.append(ServoJ(values, kwargs.get('t', 0.008), kwargs.get('lookahead_time', 0.1),
+                                   kwargs.get('gain', 300)))
+        else:
+            commands.append(SpeedJ(values, kwargs.get('a', 1.4), kwargs.get('t', 0.008)))
+    return commands
+
+
+class _Segment:
+    """One command in progress: joint positions (and speeds) as a function of the time since its start."""
+
+    def __init__(self, command, q, tool, speed):
+        self.command = command
+        self.q0 = q.copy()
+        self.tool = tool
+        if isinstance(command, (MoveJ, ServoJ, MoveJPose)):
+            if isinstance(command, MoveJPose):
+                self.q1 = kinematics.ik_nearest(command.pose, q, tool)
+            else:
+                self.q1 = np.asarray(command.q, dtype=float)
+            if np.isnan(self.q1).any():
+                raise ValueError(f"Target out of reach: {command}")
+            if isinstance(command, ServoJ) or command.t > 0:
+                self.duration = command.t
+            else:
+                self.duration = np.max(np.abs(self.q1 - self.q0)) / (command.v * speed)
+        elif isinstance(command, MoveL):
+            T0 = kinematics.fk(q, tool)
+            T1 = kinematics.pose_to_matrix(command.pose)[0]
+            self.p0, self.p1 = T0[:3, 3], T1[:3, 3]
+            self.R0 = T0[:3, :3]
+            self.rv = util.rm2rv(self.R0.T @ T1[:3, :3])
+            self.duration = command.t if command.t > 0 else \
+                np.linalg.norm(self.p1 - self.p0) / (command.v * speed)
+            self.q1 = kinematics.ik_nearest(command.pose, q, tool)
+            if np.isnan(self.q1).any():
+                raise ValueError(f"Target out of reach: {command}")
+        elif isinstance(command, SpeedJ):
+            self.qd = np.asarray(command.qd, dtype=float) * speed
+            self.duration = command.t
+        else:
+            self.duration = command.t
+        self.duration = max(float(self.duration), 1e-6)
+
+    def joints(self, elapsed, q_prev):
+        """Joint positions at `elapsed` seconds, and whether the segment is over."""
+        s = min(elapsed / self.duration, 1.0)
+        if isinstance(self.command, (MoveJ, ServoJ, MoveJPose)):
+            q = self.q0 + s * (self.q1 - self.q0)
+        elif isinstance(self.command, MoveL):
+            T = np.eye(4)
+            T[:3, :3] = self.R0 @ util.rv2rm(*(s * self.rv))
+            T[:3, 3] = self.p0 + s * (self.p1 - self.p0)
+            q = self.q1 if s >= 1.0 else kinematics.ik_nearest(kinematics.matrix_to_pose(T)[0], q_prev, self.tool)
+        elif isinstance(self.command, SpeedJ):
+            q = self.q0 + self.qd * min(elapsed, self.duration)
+        else:
+            q = q_prev
+        return q, s >= 1.0
+
+
+class MockURController:
+    """
+    TCP server speaking the realtime interface of a UR controller on one port, as the robot does on 30003:
+    every connection receives state packets at `frequency` Hz, and URScript sent on any connection
+    replaces the running program. Motion is simulated at constant speed, `speed` times the commanded one;
+    `noise` is the standard deviation (rad) of the noise on the reported joint positions.
+    """
+
+    def __init__(self, host='127.0.0.1', port=30003, frequency=125, speed=1.0, noise=0.0, start_delay=0.004,
+                 packet_length=1108, q=HOME_JOINTS, tool=(0, 0, 0.15, 0, 0, 0), seed=0):
+        self.address = (host, port)
+        self.frequency = frequency
+        self.speed = speed
+        self.noise = noise
+        self.start_delay = start_delay
+        self.dtype = state_dtype(packet_length)
+        self.tool = kinematics.pose_to_matrix(tool)[0]
+        self.rng = np.random.default_rng(seed)
+
+        self.q = np.asarray(q, dtype=float).copy()
+        self.qd = np.zeros(6)
+        self.tcp = kinematics.fk_pose(self.q, self.tool)
+        self.tcp_speed = np.zeros(6)
+        # Time the last program came to rest; benchmarks compare it with when the client noticed
+        self.finished_at = None
+        self.programs_received = 0
+
+        self._queue = deque()
+        self._segment = None
+        self._segment_start = 0.0
+        self._lock = threading.Lock()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+        self._start_time = None
+
+    @property
+    def port(self):
+        return self._server.getsockname()[1] if self._server is not None else self.address[1]
+
+    def start(self):
+        self._server = socket.create_server(self.address)
+        self._server.settimeout(0.2)
+        self._start_time = time.time()
+        for target, name in ((self._accept, "mock-ur-accept"), (self._simulate, "mock-ur-sim")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Mock UR controller on {self.address[0]}:{self.port} at {self.frequency} Hz")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._server.close()
+        for thread in self._threads:
+            thread.join()
+        with self._clients_lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            self._close(client)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def busy(self):
+        return self._segment is not None or bool(self._queue)
+
+    def load_program(self, text):
+        """Replace the running program, as the controller does when a new script arrives."""
+        commands = parse_script(text)
+        if not commands:
+            return
+        with self._lock:
+            self.programs_received += 1
+            self._queue = deque(commands)
+            self._segment = None
+            self._segment_start = time.time() + self.start_delay
+            self.finished_at = None
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            client.settimeout(None)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._clients_lock:
+                self._clients.append(client)
+            thread = threading.Thread(target=self._read_script, args=(client,), name="mock-ur-client", daemon=True)
+            thread.start()
+
+    def _read_script(self, client):
+        """Collect URScript from a client: a def ... end program, or one line per bare command."""
+        buffer = ""
+        try:
+            while not self._stop.is_set():
+                data = client.recv(4096)
+                if not data:
+                    break
+                buffer += data.decode('utf-8', errors='replace')
+                buffer = self._consume(buffer)
+        except OSError:
+            pass
+        finally:
+            if buffer.strip():
+                self.load_program(buffer)
+            self._drop(client)
+
+    def _consume(self, buffer):
+        while '\n' in buffer:
+            if buffer.lstrip().startswith('def '):
+                end = re.search(r"^end\s*$", buffer, re.MULTILINE)
+                if not end:
+                    return buffer
+                self.load_program(buffer[:end.end()])
+                buffer = buffer[end.end():].lstrip('\n')
+            else:
+                line, buffer = buffer.split('\n', 1)
+                self.load_program(line)
+        return buffer
+
+    def _drop(self, client):
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        self._close(client)
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        client.close()
+
+    def _step(self, now, dt):
+        with self._lock:
+            q = self.q
+            while True:
+                if self._segment is None:
+                    if not self._queue or now < self._segment_start:
+                        break
+                    try:
+                        self._segment = _Segment(self._queue.popleft(), q, self.tool, self.speed)
+                    except ValueError as e:
+                        logging.warning(f"Mock UR controller aborted the program: {e}")
+                        self._queue.clear()
+                        break
+                q, done = self._segment.joints(now - self._segment_start, q)
+                if not done:
+                    break
+                # Carry the time left over into the next command, as a blended program would
+                self._segment_start += self._segment.duration
+                self._segment = None
+                if not self._queue:
+                    self.finished_at = self._segment_start
+                    break
+            qd = (q - self.q) / dt
+            tcp = kinematics.fk_pose(q, self.tool)
+            tcp_speed = np.empty(6)
+            tcp_speed[:3] = (tcp[:3] - self.tcp[:3]) / dt
+            # Angular velocity from the relative rotation; rotation vectors themselves jump near pi
+            tcp_speed[3:] = util.rm2rv(util.rv2rm(*tcp[3:]) @ util.rv2rm(*self.tcp[3:]).T) / dt
+            self.q, self.qd, self.tcp, self.tcp_speed = q, qd, tcp, tcp_speed
+
+    def packet(self, now):
+        """The realtime packet for the current simulated state."""
+        record = np.zeros(1, dtype=self.dtype)
+        q = self.q + self.rng.normal(0.0, self.noise, 6) if self.noise else self.q
+        record['message_size'] = self.dtype.itemsize
+        record['time'] = now - self._start_time
+        record['q_target'] = self.q
+        record['qd_target'] = self.qd
+        record['q_actual'] = q
+        record['qd_actual'] = self.qd
+        record['tool_vector_actual'] = kinematics.fk_pose(q, self.tool) if self.noise else self.tcp
+        record['tcp_speed_actual'] = self.tcp_speed
+        record['tool_vector_target'] = self.tcp
+        record['tcp_speed_target'] = self.tcp_speed
+        record['robot_mode'] = 7  # running
+        record['safety_mode'] = 1  # normal
+        record['speed_scaling'] = 1.0
+        if 'program_state' in self.dtype.names:
+            record['program_state'] = 2 if self.busy else 1
+        return record.tobytes()
+
+    def _simulate(self):
+        period = 1.0 / self.frequency
+        last = next_tick = time.time()
+        while not self._stop.is_set():
+            now = time.time()
+            self._step(now, max(now - last, 1e-6))
+            last = now
+            packet = self.packet(now)
+            with self._clients_lock:
+                clients = list(self._clients)
+            for client in clients:
+                try:
+                    client.sendall(packet)
+                except OSError:
+                    self._drop(client)
+            next_tick += period
+            delay = next_tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock UR controller (realtime interface)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=30003)
+    parser.add_argument('--hz', type=int, default=125, choices=[125, 500])
+    parser.add_argument('--speed', type=float, default=1.0, help="multiple of the commanded speed")
+    parser.add_argument('--noise', type=float, default=0.0, help="joint noise std in rad")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    mock = MockURController(args.host, args.port, args.hz, args.speed, args.noise).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
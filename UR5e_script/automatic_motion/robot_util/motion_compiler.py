@@ -0,0 +1,92 @@
+# motion_compiler.py
+import math
+from collections import namedtuple
+import numpy as np
+import kinematics
+import util
+
+# Direction of each primitive command in base x, y, z and wrist-3 rotation, as URTasks.step_* move
+COMMAND_DELTAS = {
+    'backward': (1, 0, 0, 0),
+    'forward': (-1, 0, 0, 0),
+    'left': (0, 1, 0, 0),
+    'right': (0, -1, 0, 0),
+    'up': (0, 0, 1, 0),
+    'down': (0, 0, -1, 0),
+    'clockwise': (0, 0, 0, 1),
+    'anticlockwise': (0, 0, 0, -1),
+}
+
+# Net motion: translation in m, rotation about the tool z axis in rad
+MotionDelta = namedtuple("MotionDelta", ["dx", "dy", "dz", "drz"])
+
+
+def compile_commands(commands, step, angle):
+    """
+    Reduce a list of primitive commands (e.g. a move_holder) to one net delta.
+    step is the length of one translation in m, angle one rotation in degrees.
+    Commands without a motion ('done', None) are ignored.
+    """
+    counts = np.zeros(4)
+    for command in commands:
+        if command in COMMAND_DELTAS:
+            counts += COMMAND_DELTAS[command]
+    return MotionDelta(float(counts[0] * step), float(counts[1] * step), float(counts[2] * step),
+                       math.radians(counts[3] * angle))
+
+
+def is_zero(delta, eps=1e-12):
+    return all(abs(v) < eps for v in delta)
+
+
+def rotz(theta):
+    c, s = np.cos(theta), np.sin(theta)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+def apply_delta(tcp, delta):
+    """
+    Target TCP pose after a net delta. The rotation is about the tool z axis, which is what a
+    wrist-3 joint step does as long as the TCP offset lies along the flange axis.
+    """
+    tcp = np.asarray(tcp, dtype=float)
+    target = tcp.copy()
+    target[:3] += delta[:3]
+    if delta.drz != 0:
+        R = util.rv2rm(tcp[3], tcp[4], tcp[5]) @ rotz(delta.drz)
+        target[3:] = util.rm2rv(R)
+    return target
+
+
+def compile_path(tcp, commands, step, angle):
+    """
+    Waypoints for a command sequence when the intermediate poses matter.
+    Runs of the same command collapse into one segment, so only direction changes become waypoints.
+    """
+    waypoints = []
+    current = np.asarray(tcp, dtype=float)
+    run = []
+    for command in list(commands) + [None]:
+        if run and command != run[-1]:
+            current = apply_delta(current, compile_commands(run, step, angle))
+            waypoints.append(current)
+            run = []
+        if command in COMMAND_DELTAS:
+            run.append(command)
+    return waypoints
+
+
+def predict_path(q, tcp, commands, step, angle):
+    """
+    Joints and TCP pose after each command, from one known state (q, tcp), without asking the robot.
+    Poses follow apply_delta; joints come from one batched IK, nearest to q, with the TCP offset
+    taken from the state itself. Unreachable poses have NaN joints. Returns two (len(commands), 6) arrays.
+    """
+    tcps = []
+    current = np.asarray(tcp, dtype=float)
+    for command in commands:
+        current = apply_delta(current, compile_commands([command], step, angle))
+        tcps.append(current)
+    tcps = np.array(tcps).reshape(-1, 6)
+    tool = kinematics.tool_offset(q, tcp)
+    return kinematics.ik_nearest(tcps, q, tool), tcps
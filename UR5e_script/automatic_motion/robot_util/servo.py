@@ -0,0 +1,157 @@
+# servo.py
+# Continuous Cartesian motion through RTDEControlInterface: a control thread streams servoL (or speedL)
+# set-points at the control rate toward a target pose that commands move, so consecutive steps run as one
+# smooth motion instead of one ramped movel program each.
+import logging
+import threading
+import numpy as np
+import motion_compiler
+import util
+
+SERVO_MODES = ('servo', 'speed')
+
+
+def step_towards(pose, target, max_step, max_angle):
+    """
+    Pose moved toward target along the straight line, by at most max_step (m) and max_angle (rad);
+    translation and rotation are scaled together so both arrive at the same time.
+    """
+    dp = target[:3] - pose[:3]
+    R = util.rv2rm(*pose[3:])
+    rv = util.rm2rv(R.T @ util.rv2rm(*target[3:]))
+    dist, angle = np.linalg.norm(dp), np.linalg.norm(rv)
+    s = min(1.0, max_step / dist if dist > 0 else 1.0, max_angle / angle if angle > 0 else 1.0)
+    if s >= 1.0:
+        return np.array(target, dtype=float)
+    result = np.empty(6)
+    result[:3] = pose[:3] + s * dp
+    result[3:] = util.rm2rv(R @ util.rv2rm(*(s * rv)))
+    return result
+
+
+def pose_error(pose, target):
+    """Translation and rotation (base frame, rotation vector) from pose to target."""
+    error = np.empty(6)
+    error[:3] = target[:3] - pose[:3]
+    error[3:] = util.rm2rv(util.rv2rm(*target[3:]) @ util.rv2rm(*pose[3:]).T)
+    return error
+
+
+class ServoMotion:
+    """
+    Drive the TCP continuously toward a target pose with RTDEControlInterface.
+
+    mode 'servo': every period servoL gets the next set-point on the line to the target, advanced by
+    at most max_speed / max_angular_speed; lookahead_time (0.03-0.2 s) smooths the trajectory and
+    gain (100-2000) sets how stiffly the arm tracks it.
+    mode 'speed': every period speedL gets a velocity proportional to the remaining error
+    (speed_gain, 1/s), capped at the same maximum speeds.
+
+    Commands only move the target, so a new step that arrives while the arm is moving extends
+    the motion without a stop in between.
+    """
+
+    def __init__(self, robot, mode='servo', frequency=500.0, gain=300, lookahead_time=0.1, max_speed=0.05,
+                 max_angular_speed=0.5, acceleration=0.5, speed_gain=4.0):
+        if mode not in SERVO_MODES:
+            raise ValueError(f"Unknown servo mode {mode!r}, expected one of {SERVO_MODES}")
+        if not 0.03 <= lookahead_time <= 0.2:
+            raise ValueError(f"lookahead_time must be within [0.03, 0.2] s, got {lookahead_time}")
+        if not 100 <= gain <= 2000:
+            raise ValueError(f"gain must be within [100, 2000], got {gain}")
+        # URfunctions: its state stream gives the actual pose and tracks completion
+        self.robot = robot
+        self.mode = mode
+        self.dt = 1.0 / frequency
+        self.gain = gain
+        self.lookahead_time = lookahead_time
+        self.max_speed = max_speed
+        self.max_angular_speed = max_angular_speed
+        self.acceleration = acceleration
+        self.speed_gain = speed_gain
+
+        self.rtde = None
+        self._target = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def target(self):
+        return self._target
+
+    def start(self):
+        """Connect (or re-upload the control script after a URScript program replaced it) and start streaming."""
+        if self.running:
+            return self
+        if self.rtde is None:
+            from rtde_control import RTDEControlInterface
+            self.rtde = RTDEControlInterface(self.robot.target_ip[0], self.dt ** -1)
+        elif not self.rtde.isProgramRunning():
+            self.rtde.reuploadScript()
+        self._target = self.robot.get_current_tcp()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ur-servo", daemon=True)
+        self._thread.start()
+        logging.info(f"Servo mode started ({self.mode}, gain {self.gain}, lookahead {self.lookahead_time} s)")
+        return self
+
+    def stop(self):
+        """Bring the arm to rest and hand the controller back, e.g. before sending a URScript program."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.rtde.stopScript()
+        logging.info("Servo mode stopped")
+
+    def move_to(self, pose, wait=True, timeout=10.0):
+        """Replace the target pose; the completion is tracked on the streamed state like any movel."""
+        if not self.running:
+            raise RuntimeError("Servo mode is not running")
+        pose = np.asarray(pose, dtype=float)
+        # A 1 mm step is inside the position tolerance: the arm has to move before a stop counts
+        completion = self.robot.wait_for_target_position(
+            pose, timeout=timeout, wait=False, require_motion=not self.robot.at_target('pose', pose))
+        with self._lock:
+            self._target = pose
+        return completion.result(timeout + 1.0) if wait else completion
+
+    def move_by(self, delta, wait=True, timeout=10.0):
+        """Offset the target by a motion_compiler.MotionDelta, from where the target is, not where the arm is."""
+        with self._lock:
+            target = motion_compiler.apply_delta(self._target, delta)
+        return self.move_to(target, wait, timeout)
+
+    def _run(self):
+        setpoint = np.array(self._target, dtype=float)
+        max_step = self.max_speed * self.dt
+        max_angle = self.max_angular_speed * self.dt
+        try:
+            while not self._stop.is_set():
+                t_start = self.rtde.initPeriod()
+                target = self._target
+                if self.mode == 'servo':
+                    setpoint = step_towards(setpoint, target, max_step, max_angle)
+                    # speed and acceleration are not used by servoL; time is the period
+                    self.rtde.servoL(setpoint.tolist(), 0.0, 0.0, self.dt, self.lookahead_time, self.gain)
+                else:
+                    xd = self.speed_gain * pose_error(self.robot.get_current_tcp(), target)
+                    lin, ang = np.linalg.norm(xd[:3]), np.linalg.norm(xd[3:])
+                    if lin > self.max_speed:
+                        xd[:3] *= self.max_speed / lin
+                    if ang > self.max_angular_speed:
+                        xd[3:] *= self.max_angular_speed / ang
+                    self.rtde.speedL(xd.tolist(), self.acceleration, self.dt)
+                self.rtde.waitPeriod(t_start)
+        except Exception as e:
+            logging.error(f"Servo loop stopped: {e}")
+        finally:
+            if self.mode == 'servo':
+                self.rtde.servoStop()
+            else:
+                self.rtde.speedStop()
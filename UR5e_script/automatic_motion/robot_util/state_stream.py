@@ -0,0 +1,177 @@
+# state_stream.py
+import socket
+import threading
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import Future
+from ur_packet import PacketFramer, decode_motion
+
+# Latest decoded robot state; a fresh tuple is published for every packet and never modified.
+# The arrays are read-only views on the packet; ur_packet.parse_packet(state.packet) gives every other field.
+RobotState = namedtuple("RobotState", ["timestamp", "received", "q", "qd", "tcp", "tcp_speed", "packet"])
+
+
+def decode_state(packet, received):
+    timestamp, q, qd, tcp, tcp_speed = decode_motion(packet)
+    return RobotState(
+        timestamp=timestamp,
+        received=received,
+        q=q,
+        qd=qd,
+        tcp=tcp,
+        tcp_speed=tcp_speed,
+        packet=packet,
+    )
+
+
+class MotionWaiter:
+    """
+    Resolve a Future from the reader thread as soon as `reached(state)` holds and the robot is at rest.
+    Fails with TimeoutError past the deadline, and with RuntimeError when the robot has been at rest
+    for stall_time seconds without reaching the target.
+    """
+
+    def __init__(self, reached, moving, timeout=10.0, stall_time=1.0, label='motion', require_motion=False):
+        self.reached = reached
+        self.moving = moving
+        self.stall_time = stall_time
+        self.label = label
+        # With require_motion the target only counts once the robot has moved, for paths that end where they start
+        self._moved = not require_motion
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+        self._still_since = None
+
+    def check(self, state):
+        """Return True once the waiter is resolved."""
+        moving = self.moving(state)
+        self._moved = self._moved or moving
+        if not moving and self._moved and self.reached(state):
+            self.future.set_result(state)
+            return True
+        if self.deadline is not None and state.received > self.deadline:
+            self.future.set_exception(TimeoutError(f"{self.label} did not complete in time"))
+            return True
+        if moving:
+            self._still_since = None
+        elif not self._moved:
+            pass
+        elif self._still_since is None:
+            self._still_since = state.received
+        elif state.received - self._still_since > self.stall_time:
+            self.future.set_exception(RuntimeError(f"{self.label} stalled before reaching the target"))
+            return True
+        return False
+
+
+class RobotStateStream:
+    """
+    Keep one connection to the realtime interface open and decode every packet on a reader thread.
+    Readers get the latest RobotState with an attribute lookup; the snapshot is swapped whole,
+    so no lock is needed on the read side.
+    A snapshot older than max_age seconds is never handed out: latest() waits for a fresh one and raises
+    TimeoutError if none comes. Bytes that yield no packet for resync_time seconds drop the connection,
+    so a stream that lost packet alignment is reopened.
+    """
+
+    def __init__(self, ip, port=30003, reconnect_delay=0.5, max_age=0.1, resync_time=0.5):
+        self.target_ip = (ip, port)
+        self.reconnect_delay = reconnect_delay
+        self.max_age = max_age
+        self.resync_time = resync_time
+        self._state = None
+        self._state_changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sk = None
+        self._waiters = []
+        self._waiters_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ur-state-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._sk is not None:
+            # shutdown wakes the reader blocked in recv; close alone does not
+            try:
+                self._sk.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sk.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def latest(self, timeout=2.0, max_age=None):
+        """
+        Return the most recent state, waiting up to timeout for the first packet after a (re)start
+        or for a fresh one when the last is older than max_age (default: the stream's max_age).
+        """
+        max_age = self.max_age if max_age is None else max_age
+        state = self._state
+        if state is not None and time.time() - state.received <= max_age:
+            return state
+        deadline = time.time() + timeout
+        with self._state_changed:
+            while True:
+                state = self._state
+                if state is not None and time.time() - state.received <= max_age:
+                    return state
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._state_changed.wait(remaining)
+        if state is None:
+            raise TimeoutError(f"No state received from robot at {self.target_ip[0]}:{self.target_ip[1]}")
+        raise TimeoutError(f"Robot state from {self.target_ip[0]}:{self.target_ip[1]} is "
+                           f"{time.time() - state.received:.3f} s old")
+
+    def wait_for(self, reached, moving, timeout=10.0, stall_time=1.0, label='motion', require_motion=False):
+        """Return a Future resolved by the first streamed state that satisfies the waiter."""
+        waiter = MotionWaiter(reached, moving, timeout, stall_time, label, require_motion)
+        with self._waiters_lock:
+            self._waiters.append(waiter)
+        return waiter.future
+
+    def _publish(self, packet):
+        state = decode_state(packet, time.time())
+        with self._state_changed:
+            self._state = state
+            self._state_changed.notify_all()
+        if self._waiters:
+            with self._waiters_lock:
+                self._waiters = [waiter for waiter in self._waiters if not waiter.check(state)]
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._sk = socket.create_connection(self.target_ip, timeout=2.0)
+                self._read_packets(self._sk)
+            except OSError as e:
+                if not self._stop.is_set():
+                    logging.warning(f"Robot state stream interrupted: {e}, reconnecting")
+                    time.sleep(self.reconnect_delay)
+            finally:
+                if self._sk is not None:
+                    self._sk.close()
+
+    def _read_packets(self, sk):
+        framer = PacketFramer()
+        last_packet = time.time()
+        while not self._stop.is_set():
+            data = sk.recv(4096)
+            if not data:
+                raise ConnectionError("connection closed by robot")
+            packets = framer.feed(data)
+            # Several packets may arrive in one read when we fall behind; only the newest matters
+            if packets:
+                self._publish(packets[-1])
+                last_packet = time.time()
+            elif time.time() - last_packet > self.resync_time:
+                raise ConnectionError(f"no complete packet for {self.resync_time} s")
@@ -0,0 +1,39 @@
+# Framing tests; run from robot_util: python -m pytest test_ur_packet.py
+import numpy as np
+from ur_packet import RT_STATE_DTYPE, PacketFramer, parse_packet
+
+
+def make_packets(n, seed=0):
+    rng = np.random.default_rng(seed)
+    packets = []
+    for i in range(n):
+        record = np.zeros(1, dtype=RT_STATE_DTYPE)
+        for name in RT_STATE_DTYPE.names[2:]:
+            record[name] = rng.standard_normal(record[name].shape)
+        record['message_size'] = RT_STATE_DTYPE.itemsize
+        record['time'] = 100.0 + i * 0.008
+        packets.append(record.tobytes())
+    return packets
+
+
+def feed_chunks(stream, size=4096):
+    framer = PacketFramer()
+    return [p for i in range(0, len(stream), size) for p in framer.feed(stream[i:i + size])]
+
+
+def test_aligned_stream():
+    packets = make_packets(50)
+    assert feed_chunks(b''.join(packets), size=1500) == packets
+
+
+def test_misaligned_start():
+    packets = make_packets(200)
+    assert feed_chunks(b'\x01\x02\x03' + b''.join(packets)) == packets
+
+
+def test_truncated_first_packet():
+    packets = make_packets(200)
+    stream = b''.join(packets)[700:]
+    result = feed_chunks(stream)
+    assert result == packets[1:]
+    assert [float(parse_packet(p)['time']) for p in result[:2]] == [100.008, 100.016]
@@ -0,0 +1,174 @@
+# ur_packet.py
+import functools
+import logging
+import math
+import struct
+import numpy as np
+
+# Realtime interface (port 30003) packet layout, all big-endian doubles after the int32 length.
+# Newer controller versions append fields, so packets are decoded with the longest prefix that fits.
+RT_FIELDS = [
+    ('message_size', '>i4', 1),
+    ('time', '>f8', 1),
+    ('q_target', '>f8', 6),
+    ('qd_target', '>f8', 6),
+    ('qdd_target', '>f8', 6),
+    ('i_target', '>f8', 6),
+    ('m_target', '>f8', 6),
+    ('q_actual', '>f8', 6),
+    ('qd_actual', '>f8', 6),
+    ('i_actual', '>f8', 6),
+    ('i_control', '>f8', 6),
+    ('tool_vector_actual', '>f8', 6),
+    ('tcp_speed_actual', '>f8', 6),
+    ('tcp_force', '>f8', 6),
+    ('tool_vector_target', '>f8', 6),
+    ('tcp_speed_target', '>f8', 6),
+    ('digital_input_bits', '>f8', 1),
+    ('motor_temperatures', '>f8', 6),
+    ('controller_timer', '>f8', 1),
+    ('test_value', '>f8', 1),
+    ('robot_mode', '>f8', 1),
+    ('joint_modes', '>f8', 6),
+    ('safety_mode', '>f8', 1),
+    ('reserved_0', '>f8', 6),
+    ('tool_accelerometer_values', '>f8', 3),
+    ('reserved_1', '>f8', 6),
+    ('speed_scaling', '>f8', 1),
+    ('linear_momentum_norm', '>f8', 1),
+    ('reserved_2', '>f8', 1),
+    ('reserved_3', '>f8', 1),
+    ('v_main', '>f8', 1),
+    ('v_robot', '>f8', 1),
+    ('i_robot', '>f8', 1),
+    ('v_actual', '>f8', 6),
+    ('digital_outputs', '>f8', 1),
+    ('program_state', '>f8', 1),
+    ('elbow_position', '>f8', 3),
+    ('elbow_velocity', '>f8', 3),
+    ('safety_status', '>f8', 1),
+    ('reserved_4', '>f8', 1),
+    ('reserved_5', '>f8', 1),
+    ('reserved_6', '>f8', 1),
+    ('payload_mass', '>f8', 1),
+    ('payload_cog', '>f8', 3),
+    ('payload_inertia', '>f8', 6),
+]
+
+# Everything the robot layer reads lives in the first 540 bytes
+MIN_PACKET_LENGTH = 540
+MAX_PACKET_LENGTH = 4096
+
+
+def _field_dtype(dtype, count):
+    return (dtype, (count,)) if count > 1 else dtype
+
+
+@functools.lru_cache(maxsize=None)
+def state_dtype(length):
+    """Structured dtype of the longest field prefix that fits in a packet of `length` bytes."""
+    fields, size = [], 0
+    for name, dtype, count in RT_FIELDS:
+        itemsize = np.dtype(dtype).itemsize * count
+        if size + itemsize > length:
+            break
+        fields.append((name, _field_dtype(dtype, count)))
+        size += itemsize
+    return np.dtype(fields)
+
+
+RT_STATE_DTYPE = state_dtype(sum(np.dtype(dtype).itemsize * count for _, dtype, count in RT_FIELDS))
+
+
+def field_offsets():
+    """Byte offset and value count of every field."""
+    offsets, offset = {}, 0
+    for name, dtype, count in RT_FIELDS:
+        offsets[name] = (offset, count)
+        offset += np.dtype(dtype).itemsize * count
+    return offsets
+
+
+_OFFSETS = field_offsets()
+_TIME = struct.Struct('>d')
+# q_actual ... tcp_speed_actual are adjacent doubles; one flat view covers every field the state stream reads
+_MOTION_START = _OFFSETS['q_actual'][0]
+_MOTION_COUNT = (_OFFSETS['tcp_speed_actual'][0] - _MOTION_START) // 8 + 6
+
+
+def _motion_slice(name):
+    offset, count = _OFFSETS[name]
+    start = (offset - _MOTION_START) // 8
+    return slice(start, start + count)
+
+
+_Q, _QD, _TCP, _TCP_SPEED = (_motion_slice(name) for name in
+                             ('q_actual', 'qd_actual', 'tool_vector_actual', 'tcp_speed_actual'))
+
+
+def decode_motion(packet):
+    """
+    (time, q, qd, tcp, tcp_speed) of one packet: the time with struct, the vectors as read-only views on a
+    flat big-endian double array. Cheaper than parse_packet, which builds the structured record of all fields.
+    """
+    if len(packet) < MIN_PACKET_LENGTH:
+        raise ValueError(f"Realtime packet too short: {len(packet)} bytes")
+    values = np.frombuffer(packet, dtype='>f8', count=_MOTION_COUNT, offset=_MOTION_START)
+    return (_TIME.unpack_from(packet, _OFFSETS['time'][0])[0],
+            values[_Q], values[_QD], values[_TCP], values[_TCP_SPEED])
+
+
+def parse_packet(packet):
+    """
+    Decode one complete packet into a structured record.
+    The record is a view on the packet bytes, no field is copied.
+    """
+    if len(packet) < MIN_PACKET_LENGTH:
+        raise ValueError(f"Realtime packet too short: {len(packet)} bytes")
+    return np.frombuffer(packet, dtype=state_dtype(len(packet)), count=1)[0]
+
+
+class PacketFramer:
+    """
+    Reassemble realtime packets from a byte stream using their int32 length header.
+    A header only counts when its length is in range and the packet's time is a plausible controller time;
+    otherwise one byte is dropped and the buffer scanned again, so a stream joined mid-packet, or one that
+    lost bytes, falls back into step.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    @staticmethod
+    def _plausible(buffer):
+        """Whether the buffer starts with a packet header, judged on what has arrived so far."""
+        length = struct.unpack_from('>i', buffer, 0)[0]
+        if not MIN_PACKET_LENGTH <= length <= MAX_PACKET_LENGTH:
+            return False
+        if len(buffer) >= 12:
+            t = _TIME.unpack_from(buffer, 4)[0]
+            if not (math.isfinite(t) and 0.0 <= t < 1e9):
+                return False
+        return True
+
+    def feed(self, data):
+        """Add received bytes; return the list of packets completed by them."""
+        self._buffer += data
+        packets = []
+        skipped = 0
+        while len(self._buffer) >= 4:
+            if not self._plausible(self._buffer):
+                del self._buffer[:1]
+                skipped += 1
+                continue
+            length = struct.unpack_from('>i', self._buffer, 0)[0]
+            if len(self._buffer) < length:
+                break
+            packets.append(bytes(self._buffer[:length]))
+            del self._buffer[:length]
+        if skipped:
+            logging.warning(f"Skipped {skipped} bytes to find the next packet header")
+        return packets
+
+    def reset(self):
+        self._buffer.clear()
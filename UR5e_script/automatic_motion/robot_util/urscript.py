@@ -0,0 +1,121 @@
+# urscript.py
+# Typed URScript program builder: a sequence of motion commands compiled into one `def ... end` program,
+# so a multi-move sequence costs one send and one completion wait.
+from collections import namedtuple
+import numpy as np
+
+# Motion commands. Joint targets q are 6 angles in rad, poses are [x, y, z, rx, ry, rz] in m and rad.
+# a / v are acceleration and speed, t a fixed duration (0: use a and v), r the blend radius in m.
+MoveJ = namedtuple("MoveJ", ["q", "a", "v", "t", "r"])
+MoveJPose = namedtuple("MoveJPose", ["pose", "a", "v", "t", "r"])
+MoveL = namedtuple("MoveL", ["pose", "a", "v", "t", "r"])
+ServoJ = namedtuple("ServoJ", ["q", "t", "lookahead_time", "gain"])
+SpeedJ = namedtuple("SpeedJ", ["qd", "a", "t"])
+Sleep = namedtuple("Sleep", ["t"])
+
+
+def _vector(values, name):
+    values = np.asarray(values, dtype=float).ravel()
+    if values.shape != (6,):
+        raise ValueError(f"{name} needs 6 values, got {values.size}")
+    if not np.all(np.isfinite(values)):
+        raise ValueError(f"{name} has non-finite values: {values}")
+    return tuple(float(v) for v in values)
+
+
+def _list(values):
+    return "[" + ",".join(f"{v:.6f}" for v in values) + "]"
+
+
+def _pose(values):
+    return "p" + _list(values)
+
+
+def format_command(command):
+    """One URScript statement for a command."""
+    if isinstance(command, MoveJ):
+        return f"movej({_list(command.q)}, a={command.a}, v={command.v}, t={command.t}, r={command.r})"
+    if isinstance(command, MoveJPose):
+        return f"movej({_pose(command.pose)}, a={command.a}, v={command.v}, t={command.t}, r={command.r})"
+    if isinstance(command, MoveL):
+        return f"movel({_pose(command.pose)}, a={command.a}, v={command.v}, t={command.t}, r={command.r})"
+    if isinstance(command, ServoJ):
+        return (f"servoj({_list(command.q)}, t={command.t}, lookahead_time={command.lookahead_time}, "
+                f"gain={command.gain})")
+    if isinstance(command, SpeedJ):
+        return f"speedj({_list(command.qd)}, a={command.a}, t={command.t})"
+    if isinstance(command, Sleep):
+        return f"sleep({command.t})"
+    raise TypeError(f"Not a URScript command: {command!r}")
+
+
+class Program:
+    """
+    A URScript program built move by move; each builder method returns the program, so calls chain:
+
+        Program('pick').movej(home, r=0.02).movel(above).movel(grasp)
+
+    The blend radius of the last move is dropped when compiling, so the program ends at rest on its target.
+    """
+
+    def __init__(self, name="program"):
+        if not name.isidentifier():
+            raise ValueError(f"Invalid program name: {name!r}")
+        self.name = name
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, command):
+        format_command(command)  # reject unknown commands early
+        self.commands.append(command)
+        return self
+
+    def movej(self, q, a=1.4, v=1.05, t=0, r=0):
+        return self.add(MoveJ(_vector(q, 'movej target'), a, v, t, r))
+
+    def movej_pose(self, pose, a=1.4, v=1.05, t=0, r=0):
+        return self.add(MoveJPose(_vector(pose, 'movej pose'), a, v, t, r))
+
+    def movel(self, pose, a=1.2, v=0.25, t=0, r=0):
+        return self.add(MoveL(_vector(pose, 'movel pose'), a, v, t, r))
+
+    def servoj(self, q, t=0.008, lookahead_time=0.1, gain=300):
+        return self.add(ServoJ(_vector(q, 'servoj target'), t, lookahead_time, gain))
+
+    def speedj(self, qd, a=1.4, t=0.008):
+        return self.add(SpeedJ(_vector(qd, 'speedj speeds'), a, t))
+
+    def sleep(self, t):
+        return self.add(Sleep(t))
+
+    def final_target(self):
+        """
+        Where the program comes to rest: ('joints', q), ('pose', pose), or None
+        when it ends with a speed command and has no position target.
+        """
+        for command in reversed(self.commands):
+            if isinstance(command, (MoveJ, ServoJ)):
+                return 'joints', command.q
+            if isinstance(command, (MoveJPose, MoveL)):
+                return 'pose', command.pose
+            if isinstance(command, SpeedJ):
+                return None
+        return None
+
+    def script(self):
+        if not self.commands:
+            raise ValueError(f"Program {self.name} has no commands")
+        blended = [i for i, command in enumerate(self.commands) if 'r' in command._fields]
+        last_move = blended[-1] if blended else None
+        lines = [f"def {self.name}():"]
+        for i, command in enumerate(self.commands):
+            if i == last_move:
+                command = command._replace(r=0)
+            lines.append("  " + format_command(command))
+        lines.append("end")
+        return "\n".join(lines) + "\n"
+
+    def __str__(self):
+        return self.script()
@@ -1,61 +1,62 @@
 import numpy as np
 
-
-# 旋转矢量转旋转矩阵
-def rv2rm(rx, ry, rz):
-    theta = np.linalg.norm([rx, ry, rz])
-    kx = rx / theta
-    ky = ry / theta
-    kz = rz / theta
+# 批量版本: 输入 (N,3) 旋转矢量/rpy 或 (N,3,3) 旋转矩阵, 逐元素运算与单个版本完全一致
+# theta≈0 与 theta≈π 的奇异情况单独处理
+EPS_ZERO = 1e-12
+EPS_PI = 1e-3
+
+
+# 批量旋转矢量转旋转矩阵
+def rv2rm_batch(rv):
+    rv = np.asarray(rv, dtype=float).reshape(-1, 3)
+    # matmul 与 np.linalg.norm 对单个向量用同一个点积, 结果逐位相同
+    theta = np.sqrt((rv[:, None, :] @ rv[:, :, None])[:, 0, 0])
+    small = theta < EPS_ZERO
+    safe_theta = np.where(small, 1.0, theta)
+    kx = rv[:, 0] / safe_theta
+    ky = rv[:, 1] / safe_theta
+    kz = rv[:, 2] / safe_theta
 
     c = np.cos(theta)
     s = np.sin(theta)
     v = 1 - c
 
-    R = np.zeros((3, 3))
-    R[0][0] = kx * kx * v + c
-    R[0][1] = kx * ky * v - kz * s
-    R[0][2] = kx * kz * v + ky * s
+    R = np.empty((len(rv), 3, 3))
+    R[:, 0, 0] = kx * kx * v + c
+    R[:, 0, 1] = kx * ky * v - kz * s
+    R[:, 0, 2] = kx * kz * v + ky * s
 
-    R[1][0] = ky * kx * v + kz * s
-    R[1][1] = ky * ky * v + c
-    R[1][2] = ky * kz * v - kx * s
+    R[:, 1, 0] = ky * kx * v + kz * s
+    R[:, 1, 1] = ky * ky * v + c
+    R[:, 1, 2] = ky * kz * v - kx * s
 
-    R[2][0] = kz * kx * v - ky * s
-    R[2][1] = kz * ky * v + kx * s
-    R[2][2] = kz * kz * v + c
+    R[:, 2, 0] = kz * kx * v - ky * s
+    R[:, 2, 1] = kz * ky * v + kx * s
+    R[:, 2, 2] = kz * kz * v + c
 
+    # 零旋转
+    R[small] = np.eye(3)
     return R
 
 
-# 旋转矩阵转rpy
-def rm2rpy(R):
-    sy = np.sqrt(R[0][0] * R[0][0] + R[1][0] * R[1][0])
+# 批量旋转矩阵转rpy
+def rm2rpy_batch(R):
+    R = np.asarray(R, dtype=float).reshape(-1, 3, 3)
+    sy = np.sqrt(R[:, 0, 0] * R[:, 0, 0] + R[:, 1, 0] * R[:, 1, 0])
     singular = sy < 1e-6
 
-    if not singular:
-        x = np.arctan2(R[2][1], R[2][2])
-        y = np.arctan2(-R[2][0], sy)
-        z = np.arctan2(R[1][0], R[0][0])
-    else:
-        x = np.arctan2(-R[1][2], R[1][1])
-        y = np.arctan2(-R[2][0], sy)
-        z = 0
-
-    return np.asarray([x, y, z])
+    x = np.where(singular, np.arctan2(-R[:, 1, 2], R[:, 1, 1]), np.arctan2(R[:, 2, 1], R[:, 2, 2]))
+    y = np.arctan2(-R[:, 2, 0], sy)
+    z = np.where(singular, 0.0, np.arctan2(R[:, 1, 0], R[:, 0, 0]))
+    return np.stack([x, y, z], axis=-1)
 
 
-# rpy转旋转矩阵
-def rpy2rm(rpy):
-    # Rx = np.zeros((3, 3), dtype=rpy.dtype)
-    # Ry = np.zeros((3, 3), dtype=rpy.dtype)
-    # Rz = np.zeros((3, 3), dtype=rpy.dtype)
-
-    R0 = np.zeros((3, 3), dtype=rpy.dtype)
-
-    thetaX = rpy[0]
-    thetaY = rpy[1]
-    thetaZ = rpy[2]
+# 批量rpy转旋转矩阵
+def rpy2rm_batch(rpy):
+    rpy = np.asarray(rpy, dtype=float).reshape(-1, 3)
+    thetaX = rpy[:, 0]
+    thetaY = rpy[:, 1]
+    thetaZ = rpy[:, 2]
 
     cx = np.cos(thetaX)
     sx = np.sin(thetaX)
@@ -66,24 +67,79 @@ def rpy2rm(rpy):
     cz = np.cos(thetaZ)
     sz = np.sin(thetaZ)
 
-    R0[0][0] = cz * cy
-    R0[0][1] = cz * sy * sx - sz * cx
-    R0[0][2] = cz * sy * cx + sz * sx
-    R0[1][0] = sz * cy
-    R0[1][1] = sz * sy * sx + cz * cx
-    R0[1][2] = sz * sy * cx - cz * sx
-    R0[2][0] = -sy
-    R0[2][1] = cy * sx
-    R0[2][2] = cy * cx
+    R0 = np.empty((len(rpy), 3, 3))
+    R0[:, 0, 0] = cz * cy
+    R0[:, 0, 1] = cz * sy * sx - sz * cx
+    R0[:, 0, 2] = cz * sy * cx + sz * sx
+    R0[:, 1, 0] = sz * cy
+    R0[:, 1, 1] = sz * sy * sx + cz * cx
+    R0[:, 1, 2] = sz * sy * cx - cz * sx
+    R0[:, 2, 0] = -sy
+    R0[:, 2, 1] = cy * sx
+    R0[:, 2, 2] = cy * cx
     return R0
 
 
+# 批量旋转矩阵转旋转矢量
+def rm2rv_batch(R):
+    R = np.asarray(R, dtype=float).reshape(-1, 3, 3)
+    # 数值误差可能让 cos 略超出 [-1, 1]
+    theta = np.arccos(np.clip((R[:, 0, 0] + R[:, 1, 1] + R[:, 2, 2] - 1) / 2, -1.0, 1.0))
+    w = np.stack([R[:, 2, 1] - R[:, 1, 2], R[:, 0, 2] - R[:, 2, 0], R[:, 1, 0] - R[:, 0, 1]], axis=-1)
+
+    small = theta < EPS_ZERO
+    near_pi = np.pi - theta < EPS_PI
+    regular = ~(small | near_pi)
+
+    r = np.zeros((len(R), 3))
+    sin_theta = np.sin(theta[regular])
+    K = (1 / (2 * sin_theta))[:, None] * w[regular]
+    r[regular] = theta[regular][:, None] * K
+
+    # theta≈π: sin≈0, 转轴由对称部分 (R + R^T)/2 - cI = (1 - c) k k^T 求出
+    if np.any(near_pi):
+        Rp = R[near_pi]
+        # arccos 在 -1 附近精度很差, 改用 atan2 重新求角度
+        wp = w[near_pi]
+        theta_p = np.arctan2(np.sqrt(np.sum(wp * wp, axis=1)) / 2, (Rp[:, 0, 0] + Rp[:, 1, 1] + Rp[:, 2, 2] - 1) / 2)
+        c = np.cos(theta_p)
+        B = ((Rp + np.swapaxes(Rp, 1, 2)) / 2 - c[:, None, None] * np.eye(3)) / (1 - c)[:, None, None]
+        diag = np.diagonal(B, axis1=1, axis2=2)
+        i = np.argmax(diag, axis=1)
+        rows = np.arange(len(Rp))
+        k = B[rows, :, i] / np.sqrt(diag[rows, i])[:, None]
+        # 反对称部分给出方向 (恰好 π 时两个方向等价)
+        sign = np.where(np.sum(k * wp, axis=1) < 0, -1.0, 1.0)
+        r[near_pi] = (theta_p * sign)[:, None] * k
+    return r
+
+
+def rv2rpy_batch(rv):
+    return rm2rpy_batch(rv2rm_batch(rv))
+
+
+def rpy2rv_batch(rpy):
+    return rm2rv_batch(rpy2rm_batch(rpy))
+
+
+# 旋转矢量转旋转矩阵
+def rv2rm(rx, ry, rz):
+    return rv2rm_batch([[rx, ry, rz]])[0]
+
+
+# 旋转矩阵转rpy
+def rm2rpy(R):
+    return rm2rpy_batch(R)[0]
+
+
+# rpy转旋转矩阵
+def rpy2rm(rpy):
+    return rpy2rm_batch(rpy)[0]
+
+
 # 旋转矩阵转旋转矢量
 def rm2rv(R):
-    theta = np.arccos((R[0][0] + R[1][1] + R[2][2] - 1) / 2)
-    K = (1 / (2 * np.sin(theta))) * np.asarray([R[2][1] - R[1][2], R[0][2] - R[2][0], R[1][0] - R[0][1]])
-    r = theta * K
-    return r
+    return rm2rv_batch(R)[0]
 
 
 def rv2rpy(rx, ry, rz):
@@ -0,0 +1,77 @@
+# settle.py
+# Decide when the scene is still after a motion: the streamed TCP speed has dropped to rest and
+# consecutive camera frames stop changing, so the next capture waits as long as the arm actually
+# takes to settle instead of a fixed delay.
+import logging
+import time
+from collections import namedtuple
+import numpy as np
+
+# after: host time the next capture must be newer than; waited: seconds spent; stable: False if max_wait hit
+Settled = namedtuple("Settled", ["after", "waited", "stable"])
+
+
+def mean_frame_difference(a, b, step=4):
+    """Mean absolute difference of two RGBA frames in gray levels (0-255), on every step-th pixel."""
+    a = a[::step, ::step, :3].astype(np.int16)
+    b = b[::step, ::step, :3].astype(np.int16)
+    return float(np.abs(a - b).mean())
+
+
+class SettleDetector:
+    """
+    Wait until the arm is at rest and the image is stable.
+
+    The TCP counts as at rest once its streamed speed is below max_speed (m/s) and max_angular_speed
+    (rad/s). From then on camera frames are compared pairwise (cropped to the camera's ROI), and the
+    scene counts as stable after stable_frames consecutive mean differences (gray levels, raw RGB)
+    below max_mean_difference.
+    Whatever happens, wait() returns after max_wait seconds.
+    """
+
+    def __init__(self, state, camera, max_speed=0.002, max_angular_speed=0.01, max_mean_difference=2.0,
+                 stable_frames=2, max_wait=2.0, poll=0.002):
+        # state: callable returning the newest robot_util.state_stream.RobotState
+        self.state = state
+        self.camera = camera
+        self.max_speed = max_speed
+        self.max_angular_speed = max_angular_speed
+        self.max_mean_difference = max_mean_difference
+        self.stable_frames = stable_frames
+        self.max_wait = max_wait
+        self.poll = poll
+
+    def at_rest(self, state):
+        speed = np.asarray(state.tcp_speed, dtype=float)
+        return (np.linalg.norm(speed[:3]) < self.max_speed
+                and np.linalg.norm(speed[3:]) < self.max_angular_speed)
+
+    def wait(self):
+        start = time.time()
+        deadline = start + self.max_wait
+
+        # The robot first: the image cannot be still while the TCP is moving
+        while not self.at_rest(self.state()):
+            if time.time() >= deadline:
+                return self._timed_out(start, "the TCP is still moving")
+            time.sleep(self.poll)
+        still = time.time()
+
+        # Then the image: vibration and auto exposure still change it after the arm stops
+        try:
+            previous = self.camera.frame_after(still, timeout=deadline - time.time())
+            stable = 0
+            while True:
+                frame = self.camera.frame_after(previous.timestamp, timeout=deadline - time.time())
+                difference = mean_frame_difference(self.camera.crop(previous).array, self.camera.crop(frame).array)
+                stable = stable + 1 if difference < self.max_mean_difference else 0
+                if stable >= self.stable_frames:
+                    # The next capture is the first frame after the last one compared
+                    return Settled(previous.timestamp, time.time() - start, True)
+                previous = frame
+        except TimeoutError:
+            return self._timed_out(start, "the image is still changing")
+
+    def _timed_out(self, start, reason):
+        logging.warning(f"Scene not settled after {self.max_wait} s: {reason}")
+        return Settled(time.time(), time.time() - start, False)